@@ -0,0 +1,344 @@
+'''
+Benchmarks for the hot paths, on synthetic abstracts of growing size.
+
+Every (benchmark, size) pair runs in its own forked process. Its memory
+is the resident set size after the (untimed) prepare step and the peak
+during the timed run, which on Linux is measured from a peak reset
+(/proc/self/clear_refs) so prepare's own peak does not count. Reports
+throughput, the run's memory growth over prepare and the scaling slope
+(log time / log size, 1.0 is linear), and writes everything to JSON so
+runs (e.g. CPython vs PyPy, or before and after a change) can be compared:
+
+    python benchmark.py --sizes 1000 10000 100000 --output base.json
+    python benchmark.py --output new.json --compare base.json
+'''
+from __future__ import division
+from multiprocessing import Pipe, Process
+import argparse
+import platform
+import resource
+import random
+import json
+import math
+import traceback
+import time
+import sys
+
+from preprocessing import clean_up, preprocess
+import preprocessing
+from porter_stemmer import porter_stem, reference_porter_stem
+from classifiers import AdaBoost_SAMME, DecisionStump, NaiveBayes
+from transforms import tf_idf
+from utils import compute_IG, extract_features
+
+CATEGORIES = ['math', 'cs', 'stat', 'physics']
+SYLLABLES = ['al', 'ber', 'con', 'de', 'gen', 'in', 'lo', 'ma', 'net', 'or',
+             'pro', 'qua', 'ri', 'sta', 'ti', 'un', 'ver', 'work', 'xi', 'zo']
+SUFFIXES = ['', '', '', 's', 'ing', 'ed', 'ation', 'ness', 'ly', 'ize', 'ful']
+EXTRAS = ['$x^2$', '\\cite{ref}', 'http://arxiv.org/abs/1234', '\\emph{bold}',
+          '(see', 'below)', 'the', 'of', 'and', 'is', 'we', 'a.', 'b,']
+
+
+def synthetic_abstracts(n, seed=0, vocabulary_size=50000):
+    '''
+    Returns n abstracts and categories. Word ranks follow a Zipf-like
+    law (minus the head, so no word is in every abstract), some words
+    lean towards a category and LaTeX, citations, URLs and stop words
+    are sprinkled in so every cleaning rule has work.
+    '''
+    rng = random.Random(seed)
+    words = []
+    for i in range(vocabulary_size):
+        syllables = [SYLLABLES[(i // 20 ** k) % 20] for k in range(1 + i // 8000)]
+        words.append(''.join(syllables) + SYLLABLES[i % 17] + SUFFIXES[i % 11])
+
+    abstracts, categories = [], []
+    for _ in xrange(n):
+        category = rng.randrange(len(CATEGORIES))
+        tokens = []
+        for _ in xrange(rng.randint(40, 160)):
+            r = rng.random()
+            if r < 0.1:
+                tokens.append(rng.choice(EXTRAS))
+                continue
+            rank = int(vocabulary_size ** rng.uniform(0.3, 1)) - 1
+            if r < 0.3:
+                rank = (rank * 4 + category) % vocabulary_size
+            tokens.append(words[rank].capitalize() if r > 0.98 else words[rank])
+        abstracts.append(' '.join(tokens))
+        categories.append(CATEGORIES[category])
+    return abstracts, categories
+
+
+# Each benchmark: prepare(abstracts, categories) -> state (not timed),
+# then run(state) -> number of items processed (timed).
+
+def prepare_raw(abstracts, categories):
+    return abstracts, categories
+
+
+def prepare_examples(abstracts, categories):
+    return extract_features(map(clean_up, abstracts)), categories
+
+
+def prepare_words(abstracts, categories):
+    # clean_up stems by default: the stemmers must get unstemmed words
+    stem_words = preprocessing.STEM_WORDS
+    preprocessing.STEM_WORDS = False
+    try:
+        return [w for a in map(clean_up, abstracts) for w in a.split()]
+    finally:
+        preprocessing.STEM_WORDS = stem_words
+
+
+def prepare_fitted_nb(abstracts, categories):
+    examples, categories = prepare_examples(abstracts, categories)
+    classifier = NaiveBayes()
+    classifier.fit(examples, categories)
+    return classifier, examples
+
+
+def run_clean_up((abstracts, categories)):
+    map(clean_up, abstracts)
+    return len(abstracts)
+
+
+def run_porter_stem(words):
+    map(porter_stem, words)
+    return len(words)
+
+
+def run_reference_porter_stem(words):
+    map(reference_porter_stem, words)
+    return len(words)
+
+
+def run_preprocess((abstracts, categories)):
+    preprocess(abstracts, train=True)
+    return len(abstracts)
+
+
+def run_nb_fit((examples, categories)):
+    NaiveBayes().fit(examples, categories)
+    return len(examples)
+
+
+def run_nb_predict((classifier, examples)):
+    map(classifier.predict, examples)
+    return len(examples)
+
+
+def run_stump_fit((examples, categories)):
+    DecisionStump().fit(examples, categories)
+    return len(examples)
+
+
+def run_adaboost_round((examples, categories)):
+    AdaBoost_SAMME(n_iter=1).fit(examples, categories)
+    return len(examples)
+
+
+def run_compute_IG((examples, categories)):
+    compute_IG(examples, categories)
+    return len(examples)
+
+
+def run_tf_idf((examples, categories)):
+    tf_idf([' '.join(e) for e in examples])
+    return len(examples)
+
+
+BENCHMARKS = [
+    ('clean_up', prepare_raw, run_clean_up),
+    ('porter_stem', prepare_words, run_porter_stem),
+    ('reference_porter_stem', prepare_words, run_reference_porter_stem),
+    ('preprocess_train', prepare_raw, run_preprocess),
+    ('naive_bayes_fit', prepare_examples, run_nb_fit),
+    ('naive_bayes_predict', prepare_fitted_nb, run_nb_predict),
+    ('decision_stump_fit', prepare_examples, run_stump_fit),
+    ('adaboost_round', prepare_examples, run_adaboost_round),
+    ('compute_IG', prepare_examples, run_compute_IG),
+    ('tf_idf', prepare_examples, run_tf_idf),
+]
+
+
+def proc_memory_mb(field):
+    '''
+    A memory field of /proc/self/status (VmRSS, VmHWM), None without /proc
+    '''
+    try:
+        with open('/proc/self/status') as fp:
+            for line in fp:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 2 ** 10
+    except IOError:
+        pass
+    return None
+
+
+def reset_peak_memory():
+    '''
+    Resets the peak resident set size (VmHWM) to the current one.
+    Returns False where that is not supported.
+    '''
+    try:
+        with open('/proc/self/clear_refs', 'w') as fp:
+            fp.write('5')
+        return True
+    except IOError:
+        return False
+
+
+def peak_memory_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def run_one(connection, prepare, run, size, seed):
+    try:
+        state = prepare(*synthetic_abstracts(size, seed))
+        base_mb = proc_memory_mb('VmRSS')
+        peak_reset = base_mb is not None and reset_peak_memory()
+        start = time.time()
+        items = run(state)
+        seconds = time.time() - start
+        # without the reset, ru_maxrss may still be prepare's peak
+        peak_mb = proc_memory_mb('VmHWM') if peak_reset else peak_memory_mb()
+        connection.send((items, seconds, base_mb, peak_mb, peak_reset))
+    except Exception:
+        connection.send(traceback.format_exc())
+    connection.close()
+
+
+def measure(prepare, run, size, seed=0):
+    '''
+    Runs one benchmark at one size in a forked process
+    '''
+    receiver, sender = Pipe(duplex=False)
+    process = Process(target=run_one, args=(sender, prepare, run, size, seed))
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = None
+    process.join()
+    if result is None:
+        result = 'worker died (exit code %s)' % process.exitcode
+    if isinstance(result, str):
+        return {'size': size, 'error': result}
+
+    items, seconds, base_mb, peak_mb, peak_reset = result
+    return {
+        'size': size,
+        'items': items,
+        'seconds': seconds,
+        'items_per_second': items / seconds if seconds else None,
+        'base_mb': base_mb,
+        'peak_mb': peak_mb,
+        'run_mb': peak_mb - base_mb if peak_reset else None,
+    }
+
+
+def scaling_slope(points):
+    '''
+    Least squares slope of log(seconds) against log(size)
+    '''
+    points = [(math.log(p['size']), math.log(p['seconds']))
+              for p in points if p['seconds'] > 0]
+    if len(points) < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    num = sum((x - mean_x) * (y - mean_y) for x, y in points)
+    den = sum((x - mean_x) ** 2 for x, _ in points)
+    return num / den if den else None
+
+
+def run_benchmarks(sizes, only=None, max_seconds=300, seed=0):
+    '''
+    Runs every benchmark at every size. Sizes whose predicted running
+    time (from the slope so far) is over max_seconds are skipped.
+    '''
+    results = {}
+    for name, prepare, run in BENCHMARKS:
+        if only and name not in only:
+            continue
+        points = []
+        for size in sorted(sizes):
+            if points:
+                slope = scaling_slope(points) or 1
+                last = points[-1]
+                predicted = last['seconds'] * (size / last['size']) ** slope
+                if predicted > max_seconds:
+                    print "%-22s %8d  skipped (about %.0fs)" % (name, size, predicted)
+                    continue
+            point = measure(prepare, run, size, seed)
+            if 'error' in point:
+                print "%-22s %8d  failed\n%s" % (name, size, point['error'])
+                break
+            points.append(point)
+            print "%-22s %8d  %8.2fs  %12.0f/s  %8s MB  (peak %.1f MB)" % (
+                name, size, point['seconds'], point['items_per_second'] or 0,
+                '+%.1f' % point['run_mb'] if point['run_mb'] is not None else '?',
+                point['peak_mb'])
+        results[name] = {'points': points, 'slope': scaling_slope(points)}
+    return results
+
+
+def compare(results, baseline, tolerance=0.1):
+    '''
+    Returns the (benchmark, size, old, new) throughputs that dropped by
+    more than tolerance compared to a baseline run
+    '''
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        old = dict((p['size'], p['items_per_second']) for p in baseline[name]['points'])
+        for point in result['points']:
+            before = old.get(point['size'])
+            now = point['items_per_second']
+            if before and now and now < before * (1 - tolerance):
+                regressions.append((name, point['size'], before, now))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the hot paths')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 10000, 100000, 1000000])
+    parser.add_argument('--only', nargs='+', help='benchmark names to run')
+    parser.add_argument('--max-seconds', type=float, default=300)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--compare', help='earlier output to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.sizes, args.only, args.max_seconds, args.seed)
+    for name, result in sorted(results.items()):
+        if result['slope'] is not None:
+            print "%-22s slope %.2f" % (name, result['slope'])
+
+    with open(args.output, 'w') as fp:
+        json.dump({
+            'implementation': platform.python_implementation(),
+            'version': platform.python_version(),
+            'time': time.time(),
+            'seed': args.seed,
+            'results': results,
+        }, fp, indent=2)
+
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        for name, size, before, now in regressions:
+            print "REGRESSION %-22s %8d  %.0f/s -> %.0f/s" % (name, size, before, now)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
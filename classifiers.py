@@ -2,10 +2,107 @@ from __future__ import division
 from collections import Counter, defaultdict
 from heapq import nlargest
 from math import log, exp
+from multiprocessing import Pipe, Process
+from scipy.sparse import csr_matrix
+from corpus import Corpus, as_matrix, is_matrix
+from storage import read_model, write_model
+from transforms import build_csr
+import instrument
+import numpy as np
 import random
 
 
+def weighted_counts(X, rows, class_total, weights=None, dense=True):
+    '''
+    Given a document-term matrix and the class index of every row,
+    returns the weighted word x class counts and the weighted class counts
+    (the word x class counts as a sparse matrix unless dense)
+    '''
+    X = as_matrix(X)
+    example_count = X.shape[0]
+    if weights is None:
+        weights = np.ones(example_count)
+    weights = np.asarray(weights, dtype=float)
+
+    # (word x example) times (example x class) weights
+    indicator = csr_matrix((weights, (np.arange(example_count), rows)),
+                           shape=(example_count, class_total))
+    feature_count = X.T * indicator
+    if dense:
+        feature_count = feature_count.toarray()
+    class_count = np.bincount(rows, weights=weights, minlength=class_total)
+    return feature_count, class_count
+
+
+def information_gain(feature_count, class_count):
+    '''
+    IG of every row of a (weighted) feature x class count array,
+    computed the same way as in DecisionStump.fit
+    '''
+    w_sum = class_count.sum()
+    ratio = class_count[class_count > 0] / w_sum
+    entropy = -(ratio * np.log2(ratio)).sum()
+
+    branch_count = feature_count.sum(axis=1)
+    present = feature_count > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = feature_count / branch_count[:, np.newaxis]
+        true_entropy = np.where(present, ratio * np.log2(ratio), 0).sum(axis=1)
+
+        false_total = w_sum - branch_count
+        ratio = (class_count - feature_count) / false_total[:, np.newaxis]
+        valid = present & (ratio > 0)
+        false_entropy = np.where(valid, ratio * np.log2(ratio), 0).sum(axis=1)
+
+    IG = entropy + true_entropy * branch_count / w_sum
+    IG += false_entropy * (1 - branch_count / w_sum)
+    return IG
+
+
+def fit_examples(classifier, examples, outputs, **kwargs):
+    '''
+    Fits with fit_matrix when examples is a sparse matrix (or Corpus)
+    and the classifier has one, with fit otherwise
+    '''
+    name = 'fit.' + type(classifier).__name__
+    with instrument.stage(name, items=len(outputs)):
+        if is_matrix(examples) and hasattr(classifier, 'fit_matrix'):
+            classifier.fit_matrix(examples, outputs, **kwargs)
+        else:
+            classifier.fit(examples, outputs, **kwargs)
+
+
+def predict_examples(classifier, examples):
+    '''
+    Predicts all examples, at once for a sparse matrix (or Corpus)
+    '''
+    name = 'predict.' + type(classifier).__name__
+    with instrument.stage(name) as stage:
+        if is_matrix(examples):
+            guesses = classifier.predict_batch(examples)
+        else:
+            guesses = map(classifier.predict, examples)
+        stage.add(len(guesses))
+    return guesses
+
+
+def load_model(path, mmap=True):
+    '''
+    Loads any classifier written by Classifier.save
+    '''
+    header, arrays, vocabulary = read_model(path, mmap)
+    model = globals()[header['type']].from_arrays(header, arrays)
+    model.vocabulary = vocabulary
+    return model
+
+
 class Classifier(object):
+    # Words of the matrix columns, known for models loaded from a file
+    # or fit on a Corpus. Such models predict lists of words through
+    # predict_batch.
+    vocabulary = None
+    dictionary = None
+
     def __init__(self):
         pass
 
@@ -15,35 +112,196 @@ class Classifier(object):
     def predict(self, example):
         pass
 
+    def vectorize(self, examples):
+        '''
+        Turns lists of words into a count matrix over the vocabulary
+        '''
+        if self.dictionary is None:
+            self.dictionary = dict((w, i) for i, w in enumerate(self.vocabulary))
+        dictionary = self.dictionary
+
+        def word_indices(example):
+            return [dictionary[w] for w in example if w in dictionary]
+        return build_csr(map(word_indices, examples), len(dictionary))
+
+    def use_vocabulary(self, examples):
+        '''
+        Keeps the vocabulary of a Corpus the model is fit on
+        '''
+        if isinstance(examples, Corpus):
+            self.vocabulary = examples.vocabulary
+            self.dictionary = examples.dictionary
+
+    def add_words(self, words):
+        '''
+        Appends the words missing from the vocabulary to it, and returns
+        the index of every given word in the vocabulary
+        '''
+        if self.dictionary is None:
+            self.dictionary = dict((w, i) for i, w in enumerate(self.vocabulary))
+        new_words = [w for w in words if w not in self.dictionary]
+        if new_words:
+            # new objects: the old ones may be shared with a Corpus or model
+            self.vocabulary = list(self.vocabulary) + new_words
+            self.dictionary = dict(self.dictionary)
+            for w in new_words:
+                self.dictionary[w] = len(self.dictionary)
+        return np.array([self.dictionary[w] for w in words], dtype=int)
+
+    def save(self, path, vocabulary=None):
+        '''
+        Writes the model to path as a header plus flat arrays.
+        For a model fit on a matrix, vocabulary (the words of the
+        columns) lets the loaded model predict lists of words too.
+        '''
+        header, arrays, words = self.to_arrays()
+        header['type'] = self.__class__.__name__
+        write_model(path, header, arrays, words or vocabulary or self.vocabulary)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        '''
+        Reads a model written by save. With mmap, the arrays are
+        memory-mapped from the file instead of read into memory.
+        '''
+        model = load_model(path, mmap)
+        assert isinstance(model, cls), "%s holds a %s" % (path, type(model).__name__)
+        return model
+
 
 class NaiveBayes(Classifier):
+    '''
+    Multinomial NaiveBayes. Only raw counts are stored while fitting,
+    so a model can be updated with partial_fit or combined with merge;
+    probabilities are (re)computed lazily on the next predict.
+    '''
     def __init__(self):
         self.penalty = 18
-        self.class_prob = defaultdict(float)
-        self.feature_prob = defaultdict(lambda: defaultdict(float))
+        self.reset()
+
+    def reset(self):
+        self.class_count = Counter()
+        self.feature_count = defaultdict(Counter)
         self.all_features = set()
 
+        # Same statistics for the sparse matrix mode
+        self.classes = []
+        self.class_doc_count = np.zeros(0)
+        self.class_feature_count = np.zeros((0, 0))
+
+        self.vocabulary = None
+        self.dictionary = None
+        self.normalized = False
+
     def fit(self, examples, outputs):
-        example_count = len(examples)
-        assert example_count == len(outputs), "input/output size mismatch"
+        self.reset()
+        self.partial_fit(examples, outputs)
 
-        class_count = Counter(outputs)
-        for category, count in class_count.items():
-            self.class_prob[category] = count / example_count
+    def partial_fit(self, examples, outputs):
+        '''
+        Adds a chunk of examples to the counts
+        '''
+        if is_matrix(examples):
+            return self.partial_fit_matrix(examples, outputs)
+
+        assert len(examples) == len(outputs), "input/output size mismatch"
 
+        self.class_count.update(outputs)
         for example, category in zip(examples, outputs):
             self.all_features.update(example)
-            for feature in example:
-                self.feature_prob[category][feature] += 1
-
-        for category in self.feature_prob:
-            class_word_count = sum(self.feature_prob[category].values())
-            class_word_count += len(self.all_features)
-            for feature in self.feature_prob[category]:
-                self.feature_prob[category][feature] += 1
-                self.feature_prob[category][feature] /= class_word_count
+            self.feature_count[category].update(example)
+
+        self.normalized = False
+
+    def merge(self, other):
+        '''
+        Adds the counts of another NaiveBayes model to this one
+        '''
+        self.class_count.update(other.class_count)
+        for category, counts in other.feature_count.items():
+            self.feature_count[category].update(counts)
+        self.all_features.update(other.all_features)
+
+        self.add_matrix_counts(other.classes, other.class_doc_count,
+                               self.aligned_counts(other))
+        if self.vocabulary is None:
+            self.vocabulary = other.vocabulary
+            self.dictionary = other.dictionary
+
+        self.normalized = False
+        return self
+
+    def subtract(self, other):
+        '''
+        Removes the counts of another NaiveBayes model, fitted on
+        a subset of this model's examples, from this one
+        '''
+        self.class_count.subtract(other.class_count)
+        for category, count in self.class_count.items():
+            if count <= 0:
+                del self.class_count[category]
+
+        for category, counts in other.feature_count.items():
+            class_counts = self.feature_count[category]
+            class_counts.subtract(counts)
+            for feature in counts:
+                if class_counts[feature] <= 0:
+                    del class_counts[feature]
+
+        for feature in other.all_features:
+            if not any(feature in c for c in self.feature_count.values()):
+                self.all_features.discard(feature)
+
+        self.add_matrix_counts(other.classes, -other.class_doc_count,
+                               -self.aligned_counts(other))
+
+        self.normalized = False
+        return self
+
+    def copy(self):
+        '''
+        Returns a new model with a copy of the counts
+        '''
+        other = NaiveBayes()
+        other.penalty = self.penalty
+        return other.merge(self)
+
+    def normalize(self):
+        '''
+        Turns the raw counts into (log) probabilities
+        '''
+        example_count = sum(self.class_count.values())
+        self.class_prob = dict((category, count / example_count)
+                               for category, count in self.class_count.items())
+
+        self.feature_prob = defaultdict(dict)
+        for category, counts in self.feature_count.items():
+            class_word_count = sum(counts.values()) + len(self.all_features)
+            self.feature_prob[category] = dict(
+                (f, (count + 1) / class_word_count) for f, count in counts.items())
+
+        if len(self.classes):
+            counts = self.class_feature_count
+            self.class_log_prior = np.log(self.class_doc_count / self.class_doc_count.sum())
+
+            # Columns that never occur are unknown words and score 0
+            self.known = counts.sum(axis=0) > 0
+            class_word_count = counts.sum(axis=1) + self.known.sum()
+
+            seen = counts > 0
+            log_prob = np.log((counts + 1) / class_word_count[:, np.newaxis])
+            self.feature_log_prob = np.where(seen, log_prob, 0)
+            self.unseen_known = (self.known & ~seen).astype(float)
+
+        self.normalized = True
 
     def predict(self, x_data):
+        if self.vocabulary is not None:
+            return self.predict_batch(self.vectorize([x_data]))[0]
+
+        if not self.normalized:
+            self.normalize()
+
         class_score = defaultdict(float)
 
         for category in self.class_prob:
@@ -58,12 +316,151 @@ class NaiveBayes(Classifier):
 
         return max(class_score, key=lambda x: class_score[x])
 
+    def fit_matrix(self, X, outputs):
+        '''
+        Same as fit, but takes a document-term count matrix
+        (e.g. from transforms.create_bow_matrix) and stores the model
+        as a dense class x vocabulary array.
+        '''
+        self.reset()
+        self.partial_fit_matrix(X, outputs)
+
+    def partial_fit_matrix(self, X, outputs):
+        '''
+        Adds the rows of a document-term count matrix to the counts.
+        Columns must keep the same word indices from chunk to chunk;
+        a Corpus is matched to the model's vocabulary by word instead
+        (its new words are added to the vocabulary).
+        '''
+        if isinstance(X, Corpus) and self.vocabulary is not None:
+            if X.vocabulary is not self.vocabulary and X.vocabulary != self.vocabulary:
+                self.add_words(X.vocabulary)
+                X = X.to_matrix(self.dictionary)
+        else:
+            self.use_vocabulary(X)
+        X = as_matrix(X)
+        example_count = X.shape[0]
+        assert example_count == len(outputs), "input/output size mismatch"
+
+        classes = sorted(set(outputs))
+        mapping = dict((c, i) for i, c in enumerate(classes))
+        rows = np.array([mapping[c] for c in outputs], dtype=int)
+
+        # (class x example) indicator times (example x word) counts
+        indicator = csr_matrix((np.ones(example_count), (rows, np.arange(example_count))),
+                               shape=(len(classes), example_count))
+        self.add_matrix_counts(classes,
+                               np.bincount(rows, minlength=len(classes)),
+                               (indicator * X).toarray())
+
+    def aligned_counts(self, other):
+        '''
+        The class x word counts of another model, with the columns in
+        this model's vocabulary when both models have one
+        '''
+        counts = other.class_feature_count
+        if (self.vocabulary is None or other.vocabulary is None
+                or other.vocabulary is self.vocabulary
+                or other.vocabulary == self.vocabulary):
+            return counts
+        columns = self.add_words(other.vocabulary[:counts.shape[1]])
+        aligned = np.zeros((counts.shape[0], len(self.vocabulary)))
+        aligned[:, columns] = counts
+        return aligned
+
+    def add_matrix_counts(self, classes, doc_count, feature_count):
+        '''
+        Adds per class document and word counts, growing the count
+        arrays when there are new classes or new word columns.
+        '''
+        for category in classes:
+            if category not in self.classes:
+                self.classes.append(category)
+
+        shape = (len(self.classes), max(self.class_feature_count.shape[1],
+                                        feature_count.shape[1]))
+        if shape != self.class_feature_count.shape:
+            rows, cols = self.class_feature_count.shape
+            grown = np.zeros(shape)
+            grown[:rows, :cols] = self.class_feature_count
+            self.class_feature_count = grown
+            self.class_doc_count = np.append(
+                self.class_doc_count, np.zeros(shape[0] - len(self.class_doc_count)))
+
+        rows = [self.classes.index(c) for c in classes]
+        self.class_doc_count[rows] += doc_count
+        self.class_feature_count[rows, :feature_count.shape[1]] += feature_count
+        self.normalized = False
+
+    def predict_batch(self, X):
+        '''
+        Predicts every row of a document-term count matrix at once.
+        Must be used after fit_matrix, with the same word indices;
+        columns past the fitted vocabulary are unknown words.
+        '''
+        if not self.normalized:
+            self.normalize()
+
+        X = as_matrix(X)
+        width = min(X.shape[1], self.feature_log_prob.shape[1])
+        X = X[:, :width]
+        scores = X * self.feature_log_prob[:, :width].T + self.class_log_prior
+        scores -= self.penalty * (X * self.unseen_known[:, :width].T)
+        return [self.classes[i] for i in np.asarray(scores).argmax(axis=1)]
+
+    def to_arrays(self):
+        '''
+        Returns header, arrays and vocabulary for save.
+        Word list counts are stored like matrix counts over a vocabulary.
+        '''
+        assert not (self.class_count and len(self.classes)), \
+            "cannot save a model fit on both words and matrices"
+
+        words = None
+        if self.class_count:
+            words = sorted(self.all_features)
+            index = dict((w, i) for i, w in enumerate(words))
+            model = NaiveBayes()
+            for category in sorted(self.class_count):
+                counts = self.feature_count[category]
+                feature_count = np.zeros((1, len(words)))
+                feature_count[0, [index[f] for f in counts]] = counts.values()
+                model.add_matrix_counts([category], [self.class_count[category]],
+                                        feature_count)
+        else:
+            model = self
+        model.normalize()
+
+        header = {'penalty': self.penalty, 'classes': model.classes}
+        arrays = {
+            'class_doc_count': model.class_doc_count,
+            'class_feature_count': model.class_feature_count,
+            'class_log_prior': model.class_log_prior,
+            'feature_log_prob': model.feature_log_prob,
+            'unseen_known': model.unseen_known,
+            'known': model.known,
+        }
+        return header, arrays, words
+
+    @classmethod
+    def from_arrays(cls, header, arrays):
+        model = cls()
+        model.penalty = header['penalty']
+        model.classes = header['classes']
+        for name, array in arrays.items():
+            setattr(model, name, array)
+        model.normalized = True
+        return model
+
 
 class DecisionStump(Classifier):
     def __init__(self):
         self.ratio = 0.88
 
     def fit(self, examples, outputs, weights=None):
+        if is_matrix(examples):
+            return self.fit_matrix(examples, outputs, weights)
+
         assert len(examples) == len(outputs), "input/output size mismatch"
         self.classes = list(set(outputs))
 
@@ -113,6 +510,9 @@ class DecisionStump(Classifier):
                 self.parameters[feature][category] = value * ratio
 
     def predict(self, x_data):
+        if self.vocabulary is not None:
+            return self.predict_batch(self.vectorize([x_data]))[0]
+
         class_score = defaultdict(float)
 
         for feature in x_data:
@@ -125,45 +525,313 @@ class DecisionStump(Classifier):
         else:
             return random.choice(self.classes)
 
+    def fit_matrix(self, X, outputs, weights=None):
+        '''
+        Same as fit, but takes a document-term matrix and a weight vector.
+        The weighted feature x class counts come from one sparse product and
+        the IG of all features is computed at once. With a count matrix this
+        gives the same stump as fit; with a binary matrix, repeated words
+        in an abstract are only counted once.
+        '''
+        self.use_vocabulary(X)
+        X = as_matrix(X)
+        example_count = X.shape[0]
+        assert example_count == len(outputs), "input/output size mismatch"
+
+        classes = list(set(outputs))
+        mapping = dict((c, i) for i, c in enumerate(classes))
+        rows = np.array([mapping[c] for c in outputs], dtype=int)
+
+        feature_count, class_count = weighted_counts(X, rows, len(classes), weights)
+        self.fit_counts(classes, feature_count, class_count)
+
+    def fit_counts(self, classes, feature_count, class_count):
+        '''
+        Picks the stump from weighted word x class counts and class
+        counts (e.g. summed over shards of the examples), with the
+        columns of the counts in the order of classes
+        '''
+        self.classes = classes
+        IG = information_gain(feature_count, class_count)
+
+        branch_count = feature_count.sum(axis=1)
+        candidates = np.flatnonzero(branch_count > 0)
+        fnum = int(self.ratio * len(candidates))
+        if fnum < len(candidates):
+            best = np.argpartition(-IG[candidates], fnum)[:fnum]
+            candidates = candidates[best]
+
+        # Sparse word x class parameters, one entry per (word, class) seen
+        rows, cols = np.nonzero(feature_count[candidates] > 0)
+        rows = candidates[rows]
+        values = feature_count[rows, cols] * IG[rows] / branch_count[rows]
+        self.parameter_matrix = csr_matrix((values, (rows, cols)),
+                                           shape=feature_count.shape)
+
+    def predict_batch(self, X):
+        '''
+        Predicts every row of a document-term matrix at once.
+        Must be used after fit_matrix, with the same word indices.
+        '''
+        return [self.classes[i] if i >= 0 else random.choice(self.classes)
+                for i in self.predict_indices(X)]
+
+    def predict_indices(self, X):
+        '''
+        Index in classes of the prediction for every row, or -1 for rows
+        without any of the stump's words (predict_batch picks a random
+        class for those, in row order)
+        '''
+        X = as_matrix(X)
+        parameters = self.parameter_matrix
+        width = min(X.shape[1], parameters.shape[0])
+        X = X[:, :width]
+        parameters = parameters[:width]
+
+        mask = csr_matrix((np.ones(len(parameters.data)), parameters.indices,
+                           parameters.indptr), shape=parameters.shape)
+        scores = (X * parameters).toarray()
+        hits = (X * mask).toarray()
+        scores[hits == 0] = -np.inf
+
+        guesses = scores.argmax(axis=1)
+        guesses[~hits.any(axis=1)] = -1
+        return guesses
+
+    def to_arrays(self, words=None):
+        '''
+        Returns header, arrays and vocabulary for save.
+        Word list parameters are stored as a sparse word x class matrix
+        over the given words (by default the selected ones).
+        '''
+        if hasattr(self, 'parameters'):
+            words = words or list(self.parameters)
+            index = dict((w, i) for i, w in enumerate(words))
+            classes = dict((c, i) for i, c in enumerate(self.classes))
+            rows, cols, values = [], [], []
+            for feature, scores in self.parameters.items():
+                for category, value in scores.items():
+                    rows.append(index[feature])
+                    cols.append(classes[category])
+                    values.append(value)
+            parameters = csr_matrix((values, (rows, cols)),
+                                    shape=(len(words), len(self.classes)))
+        else:
+            parameters = self.parameter_matrix
+
+        header = {
+            'ratio': self.ratio,
+            'classes': self.classes,
+            'shape': parameters.shape,
+        }
+        arrays = {
+            'data': parameters.data,
+            'indices': parameters.indices,
+            'indptr': parameters.indptr,
+        }
+        return header, arrays, words
+
+    @classmethod
+    def from_arrays(cls, header, arrays):
+        model = cls()
+        model.ratio = header['ratio']
+        model.classes = header['classes']
+        model.parameter_matrix = csr_matrix(
+            (arrays['data'], arrays['indices'], arrays['indptr']),
+            shape=header['shape'])
+        return model
+
+
+def shard_worker(connection, X, rows, class_total):
+    '''
+    Loop of one ExampleShards process: answers 'counts' (weighted word x
+    class counts of its rows) and 'predict' (class indices a stump gives
+    its rows, see DecisionStump.predict_indices) requests until it gets 'stop'
+    '''
+    while True:
+        command, argument = connection.recv()
+        if command == 'counts':
+            connection.send(weighted_counts(X, rows, class_total, argument, dense=False))
+        elif command == 'predict':
+            connection.send(argument.predict_indices(X))
+        else:
+            break
+    connection.close()
+
+
+class ExampleShards(object):
+    '''
+    Persistent worker processes, each keeping a contiguous shard of the
+    rows of a train matrix (inherited through fork, never pickled) for
+    all the boosting rounds. Per round, only the example weights and the
+    fitted stump are sent, and the shards' counts and predictions sent back.
+    '''
+    def __init__(self, X, rows, class_total, n_jobs):
+        example_count = X.shape[0]
+        edges = np.linspace(0, example_count, min(n_jobs, example_count) + 1).astype(int)
+        self.bounds = zip(edges[:-1], edges[1:])
+        self.connections = []
+        self.processes = []
+        for s, e in self.bounds:
+            connection, child_connection = Pipe()
+            process = Process(target=shard_worker, args=(
+                child_connection, X[s:e], rows[s:e], class_total))
+            process.daemon = True
+            process.start()
+            child_connection.close()
+            self.connections.append(connection)
+            self.processes.append(process)
+
+    def ask(self, command, arguments):
+        for connection, argument in zip(self.connections, arguments):
+            connection.send((command, argument))
+        return [connection.recv() for connection in self.connections]
+
+    def counts(self, weights):
+        '''
+        Weighted word x class counts and class counts of all the rows
+        '''
+        results = self.ask('counts', [weights[s:e] for s, e in self.bounds])
+        feature_count = results[0][0]
+        for shard_feature_count, _ in results[1:]:
+            feature_count = feature_count + shard_feature_count
+        class_count = sum(class_count for _, class_count in results)
+        return feature_count.toarray(), class_count
+
+    def predict(self, classifier):
+        '''
+        Class indices the classifier gives all the rows (-1 for no hit)
+        '''
+        return np.concatenate(self.ask('predict', [classifier] * len(self.connections)))
+
+    def close(self):
+        for connection in self.connections:
+            connection.send(('stop', None))
+            connection.close()
+        for process in self.processes:
+            process.join()
+
+
+# weighted error used for the weight of a round that made no error
+MIN_ERROR = 1e-10
+
 
 class AdaBoost_SAMME(Classifier):
-    def __init__(self, n_iter=1, weak_learner=DecisionStump):
+    '''
+    Multi-class AdaBoost (SAMME). The predictions of every round on the
+    train examples are kept, so the accuracy of every number of rounds
+    can be had in one pass (staged_predict), and a fitted model can be
+    extended with more rounds (fit with warm_start).
+    With n_jobs > 1 and a weak learner that can fit from counts
+    (DecisionStump), the train examples are split between n_jobs
+    persistent processes that count and predict their share every round.
+    '''
+    def __init__(self, n_iter=1, weak_learner=DecisionStump, patience=None, n_jobs=1):
         self.Classifier = weak_learner
         self.n_iter = n_iter
-
-    def fit(self, examples, outputs):
-        example_count = len(examples)
-        self.classes = set(outputs)
-        self.K = len(self.classes)
-
-        self.errors = []
-        self.alphas = []
+        self.patience = patience
+        self.n_jobs = n_jobs
         self.classifiers = []
 
-        weights = [1/example_count for i in range(example_count)]
-
-        for n in range(self.n_iter):
-            cls = self.Classifier()
-            cls.fit(examples, outputs, weights=weights)
-            predicted = map(cls.predict, examples)
-            self.classifiers.append(cls)
-
-            data = zip(predicted, outputs, weights)
-            err = sum(w for a, b, w in data if a != b)
-            self.errors.append(err)
-
-            alpha = log((1 - err) / err) + log(self.K - 1)
-            self.alphas.append(alpha)
-
-            for i in range(example_count):
-                if predicted[i] != outputs[i]:
-                    weights[i] *= exp(alpha)
-
-            # Normalize weights
-            w_sum = sum(weights)
-            weights[:] = [w / w_sum for w in weights]
+    def fit(self, examples, outputs, warm_start=False):
+        '''
+        Boosts until the model has n_iter rounds.
+        With warm_start, an already fitted model keeps its rounds and
+        example weights and only the missing rounds are added (examples
+        must be the same ones; a loaded model has no example weights, so
+        this raises ValueError for it). With patience set, stops early once the
+        weighted error has not improved for that many rounds.
+        examples can be lists of words, a sparse document-term matrix
+        or a Corpus.
+        '''
+        if warm_start and self.classifiers and not hasattr(self, 'weights'):
+            raise ValueError("warm_start needs a model fitted in this process")
+
+        example_count = len(outputs)
+        parallel = self.n_jobs > 1 and hasattr(self.Classifier(), 'fit_counts')
+        if parallel and not is_matrix(examples):
+            examples = Corpus.from_examples(examples)
+        self.use_vocabulary(examples)
+        if isinstance(examples, Corpus):
+            examples = examples.to_matrix()
+
+        if not (warm_start and self.classifiers):
+            self.classes = list(set(outputs))
+            self.K = len(self.classes)
+
+            self.errors = []
+            self.alphas = []
+            self.classifiers = []
+            self.train_predictions = []
+            self.weights = np.ones(example_count) / example_count
+
+        index = dict((c, i) for i, c in enumerate(self.classes))
+        actual = np.array([index[c] for c in outputs])
+
+        shards = None
+        if parallel and len(self.classifiers) < self.n_iter:
+            shards = ExampleShards(as_matrix(examples), actual, self.K, self.n_jobs)
+        try:
+            self.boost(examples, outputs, actual, index, shards)
+        finally:
+            if shards is not None:
+                shards.close()
+
+    def boost(self, examples, outputs, actual, index, shards=None):
+        '''
+        Adds rounds until there are n_iter (or convergence)
+        '''
+        while len(self.classifiers) < self.n_iter and not self.converged():
+            round_stage = instrument.stage('adaboost.round', items=len(outputs),
+                                           round=len(self.classifiers))
+            with round_stage:
+                cls = self.Classifier()
+                if shards is not None:
+                    cls.fit_counts(list(self.classes), *shards.counts(self.weights))
+                    predicted = shards.predict(cls)
+                    # drawn here, in row order, as predict_batch does
+                    for i in np.flatnonzero(predicted < 0):
+                        predicted[i] = index[random.choice(cls.classes)]
+                else:
+                    weights = self.weights if is_matrix(examples) else self.weights.tolist()
+                    fit_examples(cls, examples, outputs, weights=weights)
+                    predicted = np.array([index[c] for c in predict_examples(cls, examples)])
+                self.classifiers.append(cls)
+                self.train_predictions.append(predicted)
+
+                wrong = predicted != actual
+                err = self.weights[wrong].sum()
+                self.errors.append(err)
+
+                # a perfect round gets a large but finite weight, and ends
+                # the boosting (see converged)
+                alpha = log((1 - err) / max(err, MIN_ERROR)) + log(self.K - 1)
+                self.alphas.append(alpha)
+
+                self.weights[wrong] *= exp(alpha)
+
+                # Normalize weights
+                self.weights /= self.weights.sum()
+                round_stage.set(error=err)
+
+    def converged(self):
+        '''
+        True when the last round made no error on the train examples, or
+        when the weighted error has not improved for patience rounds
+        '''
+        if not self.errors:
+            return False
+        if self.errors[-1] <= 0:
+            return True
+        if self.patience is None:
+            return False
+        best = self.errors.index(min(self.errors))
+        return len(self.errors) - 1 - best >= self.patience
 
     def predict(self, x_data):
+        if self.vocabulary is not None:
+            return self.predict_batch(self.vectorize([x_data]))[0]
+
         class_score = defaultdict(float)
 
         for cls, alpha in zip(self.classifiers, self.alphas):
@@ -171,3 +839,92 @@ class AdaBoost_SAMME(Classifier):
             class_score[predicted] += alpha
 
         return max(class_score, key=lambda x: class_score[x])
+
+    def round_predictions(self, examples=None):
+        '''
+        Yields the class indices predicted by each round's classifier.
+        Without examples, gives the cached predictions on the train set.
+        '''
+        if examples is None:
+            for predicted in self.train_predictions:
+                yield predicted
+            return
+
+        if isinstance(examples, Corpus):
+            examples = examples.to_matrix()
+
+        index = dict((c, i) for i, c in enumerate(self.classes))
+        for cls in self.classifiers:
+            yield np.array([index[c] for c in predict_examples(cls, examples)])
+
+    def staged_predict(self, examples=None):
+        '''
+        Yields the predictions of the model after 1, 2, ..., n rounds,
+        asking each round's classifier only once
+        '''
+        scores = None
+        for predicted, alpha in zip(self.round_predictions(examples), self.alphas):
+            if scores is None:
+                scores = np.zeros((len(predicted), self.K))
+            scores[np.arange(len(predicted)), predicted] += alpha
+            yield [self.classes[i] for i in scores.argmax(axis=1)]
+
+    def staged_score(self, outputs, examples=None):
+        '''
+        Returns the success rate after every number of rounds
+        '''
+        return [sum(1 for a, b in zip(guesses, outputs) if a == b) / len(outputs)
+                for guesses in self.staged_predict(examples)]
+
+    def predict_batch(self, examples):
+        '''
+        Predicts a list of examples or every row of a sparse matrix at once
+        '''
+        guesses = None
+        for guesses in self.staged_predict(examples):
+            pass
+        return guesses
+
+    def to_arrays(self):
+        '''
+        Returns header, arrays and vocabulary for save.
+        All rounds share one vocabulary; the train predictions
+        and weights are not saved, so warm start needs a refit.
+        '''
+        words = None
+        if self.classifiers and hasattr(self.classifiers[0], 'parameters'):
+            words = sorted(set(w for cls in self.classifiers for w in cls.parameters))
+
+        header = {
+            'n_iter': self.n_iter,
+            'patience': self.patience,
+            'weak_learner': self.Classifier.__name__,
+            'classes': self.classes,
+            'alphas': self.alphas,
+            'errors': self.errors,
+            'rounds': [],
+        }
+        arrays = {}
+        for i, cls in enumerate(self.classifiers):
+            cls_header, cls_arrays, _ = cls.to_arrays(words)
+            header['rounds'].append(cls_header)
+            for name, array in cls_arrays.items():
+                arrays['%d.%s' % (i, name)] = array
+        return header, arrays, words
+
+    @classmethod
+    def from_arrays(cls, header, arrays):
+        weak_learner = globals()[header['weak_learner']]
+        model = cls(header['n_iter'], weak_learner, header['patience'])
+        model.classes = header['classes']
+        model.K = len(model.classes)
+        model.alphas = header['alphas']
+        model.errors = header['errors']
+
+        for i, cls_header in enumerate(header['rounds']):
+            prefix = '%d.' % i
+            cls_arrays = dict((name[len(prefix):], array)
+                              for name, array in arrays.items()
+                              if name.startswith(prefix))
+            model.classifiers.append(weak_learner.from_arrays(cls_header, cls_arrays))
+        return model
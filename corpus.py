@@ -0,0 +1,174 @@
+from __future__ import division
+from array import array
+from scipy.sparse import csr_matrix, issparse
+import numpy as np
+
+
+def build_dictionary(abstracts):
+    '''
+    Returns a mapping of all the words in dataset to an index
+    '''
+    all_words = set()
+    for abstract in abstracts:
+        words = abstract.split(' ')
+        all_words.update(words)
+    return dict((v, i) for i, v in enumerate(all_words))
+
+
+def is_matrix(examples):
+    '''
+    True for examples stored as a sparse matrix or a Corpus
+    (as opposed to lists of words)
+    '''
+    return issparse(examples) or isinstance(examples, Corpus)
+
+
+def as_matrix(examples):
+    '''
+    Returns examples as a CSR count matrix
+    '''
+    if isinstance(examples, Corpus):
+        return examples.to_matrix()
+    return csr_matrix(examples)
+
+
+class Corpus(object):
+    '''
+    A set of abstracts stored as one flat buffer of word ids, with the
+    offset of each abstract in it, plus the vocabulary (list of words).
+    Slicing with a range shares the buffer; indexing with a single
+    position gives back that abstract's list of words.
+    '''
+    def __init__(self, token_ids, offsets, vocabulary, dictionary=None):
+        self.token_ids = token_ids
+        self.offsets = offsets
+        self.vocabulary = vocabulary
+        self._dictionary = dictionary
+
+    @classmethod
+    def from_examples(cls, examples, vocabulary=None):
+        '''
+        Builds a corpus from lists of words (e.g. extract_features output).
+        Without a vocabulary, it is made of all the words seen; with one,
+        words outside of it are dropped.
+        '''
+        grow = vocabulary is None
+        dictionary = dict((w, i) for i, w in enumerate(vocabulary or []))
+        setdefault = dictionary.setdefault
+        get = dictionary.get
+
+        token_ids = array('i')
+        offsets = array('l', [0])
+        for example in examples:
+            if grow:
+                token_ids.extend([setdefault(w, len(dictionary)) for w in example])
+            else:
+                token_ids.extend([i for i in map(get, example) if i is not None])
+            offsets.append(len(token_ids))
+
+        if grow:
+            vocabulary = [None] * len(dictionary)
+            for word, i in dictionary.iteritems():
+                vocabulary[i] = word
+
+        return cls(np.frombuffer(token_ids, dtype=np.intc),
+                   np.frombuffer(offsets, dtype=np.int_),
+                   list(vocabulary), dictionary)
+
+    @classmethod
+    def from_abstracts(cls, abstracts, vocabulary=None):
+        '''
+        Same as from_examples, for cleaned abstracts
+        '''
+        return cls.from_examples((a.split() for a in abstracts), vocabulary)
+
+    @property
+    def dictionary(self):
+        '''
+        Mapping word -> id
+        '''
+        if self._dictionary is None:
+            self._dictionary = dict((w, i) for i, w in enumerate(self.vocabulary))
+        return self._dictionary
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def position(self, i):
+        '''
+        i as an index in [0, len), counting from the end when negative
+        '''
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('corpus index out of range')
+        return i
+
+    def ids(self, i):
+        '''
+        Word ids of the i-th abstract (a view on the buffer)
+        '''
+        i = self.position(i)
+        return self.token_ids[self.offsets[i]:self.offsets[i + 1]]
+
+    def __getitem__(self, key):
+        if isinstance(key, slice) and key.step in (None, 1):
+            start, stop, _ = key.indices(len(self))
+            stop = max(start, stop)
+            return Corpus(self.token_ids, self.offsets[start:stop + 1],
+                          self.vocabulary, self._dictionary)
+
+        if isinstance(key, (int, long, np.integer)):
+            return [self.vocabulary[i] for i in self.ids(key)]
+
+        # Any other selection of abstracts, the buffer is gathered
+        if isinstance(key, slice):
+            key = np.arange(*key.indices(len(self)))
+        key = np.asarray(key, dtype=int)
+        key = np.where(key < 0, key + len(self), key)
+        if len(key) and not (0 <= key.min() and key.max() < len(self)):
+            raise IndexError('corpus index out of range')
+        starts = self.offsets[key]
+        lengths = self.offsets[key + 1] - starts
+        offsets = np.zeros(len(key) + 1, dtype=np.int_)
+        np.cumsum(lengths, out=offsets[1:])
+        positions = np.arange(offsets[-1]) + np.repeat(starts - offsets[:-1], lengths)
+        return Corpus(self.token_ids[positions], offsets,
+                      self.vocabulary, self._dictionary)
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+    def lengths(self):
+        '''
+        Number of words of every abstract
+        '''
+        return np.diff(self.offsets)
+
+    def to_matrix(self, dictionary=None):
+        '''
+        Returns the CSR matrix of word counts, with one column per word of
+        the vocabulary or, given a dictionary, per word of the dictionary
+        (other words are dropped)
+        '''
+        start, end = self.offsets[0], self.offsets[-1]
+        token_ids = self.token_ids[start:end]
+        indptr = self.offsets - start
+        width = len(self.vocabulary)
+
+        if dictionary is not None:
+            remap = np.array([dictionary.get(w, -1) for w in self.vocabulary],
+                             dtype=np.intc)
+            token_ids = remap[token_ids]
+            kept = token_ids >= 0
+            kept_before = np.zeros(len(token_ids) + 1, dtype=np.int_)
+            np.cumsum(kept, out=kept_before[1:])
+            indptr = kept_before[indptr]
+            token_ids = token_ids[kept]
+            width = len(dictionary)
+
+        matrix = csr_matrix((np.ones(len(token_ids)), token_ids, indptr),
+                            shape=(len(self), width), copy=True)
+        matrix.sum_duplicates()
+        return matrix
@@ -0,0 +1,252 @@
+'''
+Per-stage instrumentation: wall time, item counts and memory of each
+stage of a run, exported as a JSON summary and as Chrome trace events
+(open in chrome://tracing or https://ui.perfetto.dev).
+
+Off by default; when off, stage() hands back a shared no-op object, so
+the cost is one function call and one flag test per stage.
+
+    import instrument
+    instrument.enable()                      # or INSTRUMENT=1 in the environment
+    with instrument.stage('fit', items=len(examples)) as s:
+        ...
+        s.add(extra_items)
+    instrument.count('cache hits', 10)
+    instrument.write_summary('run_summary.json')
+    instrument.write_trace('run_trace.json')
+
+Memory is the resident set size (current and peak) of the process:
+tracemalloc does not exist on Python 2 or PyPy.
+'''
+from __future__ import division
+from collections import defaultdict
+import threading
+import resource
+import json
+import time
+import sys
+import os
+
+ENABLED = bool(os.environ.get('INSTRUMENT'))
+EVENTS = []
+COUNTERS = defaultdict(int)
+START = time.time()
+
+PAGE_MB = os.sysconf('SC_PAGE_SIZE') / 2 ** 20 if hasattr(os, 'sysconf') else 0
+
+
+def enable():
+    global ENABLED
+    ENABLED = True
+
+
+def disable():
+    global ENABLED
+    ENABLED = False
+
+
+def reset():
+    '''
+    Forgets every recorded stage and counter
+    '''
+    global START
+    del EVENTS[:]
+    COUNTERS.clear()
+    START = time.time()
+
+
+def rss_mb():
+    '''
+    Current resident set size (None where /proc is missing)
+    '''
+    try:
+        with open('/proc/self/statm') as fp:
+            return int(fp.read().split()[1]) * PAGE_MB
+    except (IOError, IndexError, ValueError):
+        return None
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+class NullStage(object):
+    '''
+    What stage() gives back when instrumentation is off
+    '''
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def add(self, items):
+        pass
+
+    def set(self, **args):
+        pass
+
+
+NULL_STAGE = NullStage()
+
+
+class Stage(object):
+    '''
+    Times a block and records it as one event on exit
+    '''
+    def __init__(self, name, items, args):
+        self.name = name
+        self.items = items
+        self.args = args
+
+    def __enter__(self):
+        self.rss_start = rss_mb()
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.time()
+        args = dict(self.args)
+        if self.items is not None:
+            args['items'] = self.items
+        args['rss_mb'] = rss_mb()
+        args['rss_delta_mb'] = (args['rss_mb'] - self.rss_start
+                                if self.rss_start is not None else None)
+        args['peak_rss_mb'] = peak_rss_mb()
+        if exc[0] is not None:
+            args['error'] = exc[0].__name__
+        EVENTS.append({
+            'name': self.name,
+            'start': self.start,
+            'seconds': end - self.start,
+            'pid': os.getpid(),
+            'tid': threading.current_thread().ident,
+            'args': args,
+        })
+        return False
+
+    def add(self, items):
+        '''
+        Adds to the stage's item count (e.g. from inside a loop)
+        '''
+        self.items = (self.items or 0) + items
+
+    def set(self, **args):
+        '''
+        Attaches extra values to the recorded event
+        '''
+        self.args.update(args)
+
+
+def stage(name, items=None, **args):
+    '''
+    Context manager timing a stage. items is the number of things the
+    stage processes (used for throughput), args go into the event as is.
+    '''
+    if not ENABLED:
+        return NULL_STAGE
+    return Stage(name, items, args)
+
+
+def count(name, n=1):
+    if ENABLED:
+        COUNTERS[name] += n
+
+
+def mark():
+    '''
+    Position in the event list, for events_since
+    '''
+    return len(EVENTS)
+
+
+def events_since(position):
+    return EVENTS[position:]
+
+
+def absorb(events):
+    '''
+    Adds events recorded by other processes (e.g. pool workers, which
+    return them with their results). Events of this process are already
+    recorded and are skipped.
+    '''
+    pid = os.getpid()
+    EVENTS.extend(e for e in events if e['pid'] != pid)
+
+
+def summary():
+    '''
+    Per stage totals: calls, seconds (total, mean, max), items,
+    items per second and the largest memory growth and peak seen
+    '''
+    stages = {}
+    for event in EVENTS:
+        s = stages.setdefault(event['name'], {
+            'calls': 0, 'seconds': 0, 'max_seconds': 0, 'items': 0,
+            'max_rss_delta_mb': None, 'peak_rss_mb': None,
+        })
+        args = event['args']
+        s['calls'] += 1
+        s['seconds'] += event['seconds']
+        s['max_seconds'] = max(s['max_seconds'], event['seconds'])
+        s['items'] += args.get('items') or 0
+        s['max_rss_delta_mb'] = max(s['max_rss_delta_mb'], args['rss_delta_mb'])
+        s['peak_rss_mb'] = max(s['peak_rss_mb'], args['peak_rss_mb'])
+
+    for s in stages.values():
+        s['mean_seconds'] = s['seconds'] / s['calls']
+        s['items_per_second'] = (s['items'] / s['seconds']
+                                 if s['items'] and s['seconds'] else None)
+
+    return {
+        'wall_seconds': time.time() - START,
+        'peak_rss_mb': peak_rss_mb(),
+        'stages': stages,
+        'counters': dict(COUNTERS),
+    }
+
+
+def trace_events():
+    '''
+    The recorded stages as Chrome trace events (complete 'X' events,
+    timestamps in microseconds since reset / import)
+    '''
+    trace = []
+    for event in EVENTS:
+        trace.append({
+            'name': event['name'],
+            'ph': 'X',
+            'ts': (event['start'] - START) * 1e6,
+            'dur': event['seconds'] * 1e6,
+            'pid': event['pid'],
+            'tid': event['tid'],
+            'args': event['args'],
+        })
+    return trace
+
+
+def write_summary(path='instrument_summary.json'):
+    with open(path, 'w') as fp:
+        json.dump(summary(), fp, indent=2, sort_keys=True)
+
+
+def write_trace(path='instrument_trace.json'):
+    with open(path, 'w') as fp:
+        json.dump({'traceEvents': trace_events(), 'displayTimeUnit': 'ms'}, fp)
+
+
+def print_summary():
+    '''
+    Prints the stages, slowest first
+    '''
+    stages = summary()['stages']
+    print "%-28s %6s %10s %12s %10s" % ('stage', 'calls', 'seconds', 'items/s', 'peak MB')
+    for name in sorted(stages, key=lambda n: -stages[n]['seconds']):
+        s = stages[name]
+        print "%-28s %6d %10.3f %12s %10.1f" % (
+            name, s['calls'], s['seconds'],
+            '%.0f' % s['items_per_second'] if s['items_per_second'] else '-',
+            s['peak_rss_mb'] or 0)
+    for name, value in sorted(COUNTERS.items()):
+        print "%-28s %d" % (name, value)
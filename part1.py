@@ -3,8 +3,8 @@ from __future__ import division
 from preprocessing import *
 from classifiers import *
 from utils import *
+import instrument  # INSTRUMENT=1 python part1.py to record stage timings
 
-import cPickle as pickle
 import random
 random.seed(0)
 
@@ -13,43 +13,28 @@ random.seed(0)
 # Prepare data
 # ------------
 abstracts, categories = load_train_data()
-# clean_abstracts = preprocess(abstracts, train=True)
+clean_abstracts = preprocess(abstracts, cache=CleanCache())
 
-# # IG pruning
-# examples = extract_features(clean_abstracts)
-# IG = compute_IG(examples, categories)
-# IG_words = sorted(IG, key=lambda x: IG[x])
-# threshold = int(len(IG_words) * 0.06)
-# word_remover = word_remove_factory(IG_words[:threshold])
-# clean_abstracts = map(word_remover, clean_abstracts)
+# Words seen less than 3 times are dropped, from the test set too
+vocabulary = Vocabulary(min_count=3).fit(clean_abstracts)
 
-with open('clean_abstracts.pickle') as fp:
-    clean_abstracts = pickle.load(fp)
+# # IG pruning: also drop the 6% least informative words
+# top_k = int(len(vocabulary) * 0.94)
+# vocabulary = Vocabulary(min_count=3, top_k=top_k).fit(clean_abstracts, categories)
 
 # # Shuffle the data
 # data = zip(clean_abstracts, categories)
 # random.shuffle(data)
 # clean_abstracts[:], categories[:] = zip(*data)
 
-examples = extract_features(clean_abstracts)
+examples = vocabulary.to_corpus(clean_abstracts)
 
 #------------
 # K-fold test
 # -----------
 
-predictions = []
-success_rates = []
-for data in CrossValidation(examples, categories, k=5):
-    train_data, train_result, test_data, test_result = data
-
-    classifier = NaiveBayes()
-    classifier.fit(train_data, train_result)
-
-    guesses = map(classifier.predict, test_data)
-    correct = filter(lambda x: x[0] == x[1], zip(guesses, test_result))
-    ratio = len(correct) / len(test_result)
-    success_rates.append(ratio)
-    predictions.extend(guesses)
+# Each example is counted once, see count_folds
+success_rates, predictions = count_cross_validate(examples, categories, k=5)
 
 success_ratio = sum(success_rates) / len(success_rates) * 100
 print "Average success rate:", success_ratio
@@ -59,7 +44,7 @@ print "Average success rate:", success_ratio
 # Test cases
 # ----------
 
-# test_data = preprocess(load_test_data())
+# test_data = preprocess(load_test_data(), vocabulary=vocabulary)
 # test_examples = extract_features(test_data)
 
 # classifier = NaiveBayes()
@@ -67,3 +52,9 @@ print "Average success rate:", success_ratio
 # guesses = map(classifier.predict, test_examples)
 
 # write_test_output(guesses)
+
+
+if instrument.ENABLED:
+    instrument.print_summary()
+    instrument.write_summary()
+    instrument.write_trace()
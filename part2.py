@@ -3,8 +3,9 @@ from __future__ import division
 from preprocessing import *
 from classifiers import *
 from utils import *
+import instrument  # INSTRUMENT=1 python part2.py to record stage timings
 
-import cPickle as pickle
+from multiprocessing import cpu_count
 import random
 random.seed(0)
 
@@ -12,49 +13,43 @@ random.seed(0)
 # Prepare data
 # ------------
 abstracts, categories = load_train_data()
-# clean_abstracts = preprocess(abstracts, train=True)
+clean_abstracts = preprocess(abstracts, cache=CleanCache())
 
-# # IG pruning
-# examples = extract_features(clean_abstracts)
-# IG = compute_IG(examples, categories)
-# IG_words = sorted(IG, key=lambda x: IG[x])
-# threshold = int(len(IG_words) * 0.06)
-# word_remover = word_remove_factory(IG_words[:threshold])
-# clean_abstracts = map(word_remover, clean_abstracts)
+# Words seen less than 3 times are dropped, from the test set too
+vocabulary = Vocabulary(min_count=3).fit(clean_abstracts)
 
-with open('clean_abstracts.pickle') as fp:
-    clean_abstracts = pickle.load(fp)
+# # IG pruning: also drop the 6% least informative words
+# top_k = int(len(vocabulary) * 0.94)
+# vocabulary = Vocabulary(min_count=3, top_k=top_k).fit(clean_abstracts, categories)
 
 # # Shuffle the data
 # data = zip(clean_abstracts, categories)
 # random.shuffle(data)
 # clean_abstracts[:], categories[:] = zip(*data)
 
-examples = extract_features(clean_abstracts)
+examples = vocabulary.to_corpus(clean_abstracts)
 
 #------------
 # K-fold test
 # -----------
 
+# Folds run in parallel, one process per fold
+results = cross_validate(AdaBoost_SAMME, examples, categories, k=10,
+                         workers=cpu_count(), train_score=True)
+
 predictions = []
 valid_success = []
 train_success = []
-for data in CrossValidation(examples, categories, k=10):
-    train_data, train_result, test_data, test_result = data
-
-    classifier = AdaBoost_SAMME()
-    classifier.fit(train_data, train_result)
+for result in results:
+    print "Fold %d (fit %.1fs, predict %.1fs)" % (
+        result['fold'], result['fit_time'], result['predict_time'])
 
-    guesses = map(classifier.predict, test_data)
-    correct = filter(lambda x: x[0] == x[1], zip(guesses, test_result))
-    ratio = len(correct) / len(test_result)
+    ratio = result['success_rate']
     print "Validation success rate:", ratio
     valid_success.append(ratio)
-    predictions.extend(guesses)
+    predictions.extend(result['predictions'])
 
-    guesses = map(classifier.predict, train_data)
-    correct = filter(lambda x: x[0] == x[1], zip(guesses, train_result))
-    ratio = len(correct) / len(train_result)
+    ratio = result['train_success_rate']
     train_success.append(ratio)
     print "Training success rate:", ratio
 
@@ -68,7 +63,7 @@ valid_ratio = sum(valid_success) / len(valid_success) * 100
 # Test cases
 # ----------
 
-# test_data = preprocess(load_test_data())
+# test_data = preprocess(load_test_data(), vocabulary=vocabulary)
 # test_examples = extract_features(test_data)
 
 # classifier = AdaBoost_SAMME()
@@ -76,3 +71,9 @@ valid_ratio = sum(valid_success) / len(valid_success) * 100
 # guesses = map(classifier.predict, test_examples)
 
 # write_test_output(guesses)
+
+
+if instrument.ENABLED:
+    instrument.print_summary()
+    instrument.write_summary()
+    instrument.write_trace()
@@ -5,14 +5,31 @@ from sklearn.linear_model import SGDClassifier
 from sklearn.pipeline import Pipeline
 from sklearn import svm
 from preprocessing import *
-import cPickle as pickle
+from transforms import RfTransformer
 from utils import *
 
+
+# Term weighting: 'tfidf', or 'tfrf' for tf * relevance frequency
+# (supervised, see transforms.RfTransformer)
+WEIGHTING = 'tfidf'
+
+
+def make_classifier():
+    if WEIGHTING == 'tfrf':
+        features = [
+            ('tf', TfidfVectorizer(ngram_range=(1, 2), use_idf=False, norm=None)),
+            ('rf', RfTransformer(norm='l2')),
+        ]
+    else:
+        features = [('tfidf', TfidfVectorizer(ngram_range=(1, 2)))]
+    return Pipeline(features + [('clf', SGDClassifier(alpha=7.7e-6, n_iter=13))])
+
+
 #-------------
 # Prepare data
 # ------------
 abstracts, categories = load_train_data()
-clean_abstracts = preprocess(abstracts, train=True)
+clean_abstracts = preprocess(abstracts, train=True, cache=CleanCache())
 
 # IG pruning
 examples = extract_features(clean_abstracts)
@@ -22,9 +39,6 @@ threshold = int(len(IG_words) * 0.05)
 word_remover = word_remove_factory(IG_words[:threshold])
 clean_abstracts = map(word_remover, clean_abstracts)
 
-# with open('clean_abstracts.pickle') as fp:
-#     clean_abstracts = pickle.load(fp)
-
 #------------
 # K-fold test
 # -----------
@@ -33,11 +47,7 @@ success_rates = []
 for data in CrossValidation(clean_abstracts, categories, k=5):
     train_data, train_result, test_data, test_result = data
 
-    clf = Pipeline([
-        ('tfidf', TfidfVectorizer(ngram_range=(1, 2))),
-        ('clf', SGDClassifier(alpha=7.7e-6, n_iter=13)),
-    ])
-
+    clf = make_classifier()
     clf.fit(train_data, train_result)
     guesses = clf.predict(test_data)
 
@@ -55,11 +65,7 @@ print "Average success rate:", success_ratio
 
 # test_data = preprocess(load_test_data())
 
-# clf = Pipeline([
-#         ('tfidf', TfidfVectorizer(ngram_range=(1, 2))),
-#         ('clf', SGDClassifier(alpha=7.7e-6, n_iter=13)),
-# ])
-
+# clf = make_classifier()
 # clf.fit(clean_abstracts, categories)
 # guesses = clf.predict(test_data)
 
@@ -1,6 +1,15 @@
 from collections import Counter
+from hashlib import sha1
+from multiprocessing import Pool
 from porter_stemmer import *
 from utils import *
+from vocabulary import Vocabulary
+import instrument
+import inspect
+import sqlite3
+import string
+import time
+import zlib
 import re
 
 
@@ -17,6 +26,16 @@ NUMBER_RE = re.compile('\d+')
 
 SEPARATOR_RE = re.compile('[ -/]')
 
+# Same character sets for str.translate, used by tokenize
+PUNCTUATION_CHARS = '.,?!'
+BRACKET_CHARS = '[](){}<>'
+SEPARATOR_TABLE = string.maketrans(''.join(map(chr, range(ord(' '), ord('/') + 1))),
+                                   ' ' * (ord('/') - ord(' ') + 1))
+WHITESPACE_RE = re.compile('[\t\n\r\x0b\x0c]')
+
+# stemming goes through porter_stemmer.STEM_CACHE, see cache_info()
+STEM_WORDS = True
+
 STOP_WORDS = set([
     'the', 'is', 'at', 'which', 'on', 'of', 'and', 'to', 'we', 'us', 'for',
     'that', 'this', 'with', 'are', 'by', 'as', 'an', 'be', 'from', 'can',
@@ -33,26 +52,195 @@ def word_remove_factory(to_remove):
 
 
 def build_word_counts(abstracts):
-    words = []
+    word_count = Counter()
     for abstract in abstracts:
-        words.extend(abstract.split(' '))
-    return Counter(words)
+        word_count.update(abstract.split(' '))
+    return word_count
 
 
-def preprocess(abstracts, train=False):
+def clean_chunk(args):
+    '''
+    Worker for preprocess: cleans a chunk of abstracts and,
+    when training, also returns the chunk's word counts
+    '''
+    abstracts, train = args
     clean_abstracts = map(clean_up, abstracts)
+    word_count = build_word_counts(clean_abstracts) if train else Counter()
+    return clean_abstracts, word_count
+
+
+def clean_all(abstracts, train=False, workers=1, chunksize=1000):
+    '''
+    Runs clean_up on all abstracts and, when training, counts the words.
+    With workers > 1 the abstracts are split in chunks of size chunksize
+    and cleaned by a process pool; the output stays in input order and
+    word counts are merged across chunks.
+    '''
+    if workers > 1:
+        chunks = ((chunk, train) for chunk in chunked(abstracts, chunksize))
+        clean_abstracts = []
+        word_count = Counter()
+        pool = Pool(workers)
+        try:
+            for chunk, counts in pool.imap(clean_chunk, chunks):
+                clean_abstracts.extend(chunk)
+                word_count.update(counts)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        clean_abstracts = map(clean_up, abstracts)
+        word_count = build_word_counts(clean_abstracts) if train else None
+
+    return clean_abstracts, word_count
+
+
+def preprocess(abstracts, train=False, workers=1, chunksize=1000,
+               min_count=3, cache=None, vocabulary=None):
+    '''
+    Cleans up all abstracts (see clean_all for workers and chunksize).
+    When training, words appearing less than min_count times are removed;
+    given a Vocabulary, it is fit on the word counts (with its own
+    thresholds) instead. Those counts have no categories: for IG
+    thresholds (top_k, min_IG), use Vocabulary.fit(examples, categories)
+    on the cleaned abstracts. Otherwise, given a fitted Vocabulary (e.g.
+    for the test set), the words it does not keep are removed.
+    With a CleanCache, only the abstracts missing from it are cleaned.
+    '''
+    with instrument.stage('preprocess.clean') as stage:
+        if cache is not None:
+            clean_abstracts = cache.clean(abstracts, workers, chunksize)
+            word_count = build_word_counts(clean_abstracts) if train else None
+        else:
+            clean_abstracts, word_count = clean_all(abstracts, train, workers, chunksize)
+        stage.add(len(clean_abstracts))
 
     if train:
-        # Remove words that appear only once
-        # Reduces dictinary size from 85k to 47k
-        word_count = build_word_counts(clean_abstracts)
-        rare_words = set(w for w, c in word_count.items() if c <= 2)
-        word_remover = word_remove_factory(rare_words)
-        clean_abstracts = map(word_remover, clean_abstracts)
+        with instrument.stage('preprocess.prune_rare_words', items=len(clean_abstracts)) as stage:
+            # Remove words that appear only once
+            # Reduces dictinary size from 85k to 47k
+            if vocabulary is None:
+                vocabulary = Vocabulary(min_count)
+            vocabulary.fit_counts(word_count)
+            clean_abstracts = vocabulary.transform(clean_abstracts)
+            stage.set(vocabulary=len(word_count), removed=len(word_count) - len(vocabulary))
+    elif vocabulary is not None:
+        with instrument.stage('preprocess.prune_vocabulary', items=len(clean_abstracts)):
+            clean_abstracts = vocabulary.transform(clean_abstracts)
 
     return clean_abstracts
 
 
+def config_fingerprint():
+    '''
+    Hash of everything clean_up's output depends on: the regexes,
+    the stop words, whether words are stemmed, clean_up's own code, the
+    code of the functions it calls (e.g. stem_words) and the whole
+    module they come from if it is another one (e.g. porter_stemmer)
+    '''
+    parts = [r.pattern for r in (URL_RE, CITE_RE, EQUATION_RE, PUNCTUATION_RE,
+                                 STYLE1_RE, STYLE2_RE, SPECIALCHAR_RE,
+                                 BRACKET_RE, NUMBER_RE, SEPARATOR_RE)]
+    parts.append(' '.join(sorted(STOP_WORDS)))
+    parts.append(str(STEM_WORDS))
+    parts.append(inspect.getsource(clean_up))
+
+    helpers = [globals()[name] for name in clean_up.func_code.co_names
+               if inspect.isfunction(globals().get(name))]
+    parts.extend(inspect.getsource(helper) for helper in helpers)
+    modules = set(inspect.getmodule(helper) for helper in helpers)
+    modules.discard(inspect.getmodule(clean_up))
+    for module in sorted(modules, key=lambda m: m.__name__):
+        parts.append(inspect.getsource(module))
+    return sha1('\0'.join(parts)).hexdigest()
+
+
+class CleanCache(object):
+    '''
+    On-disk cache of clean_up results (an sqlite file), keyed by a hash
+    of the raw abstract and of the cleaning configuration, so a change
+    in the configuration never returns stale results. Values are zlib
+    compressed; once the file holds more than max_bytes of values,
+    the least recently used ones are evicted.
+    '''
+    def __init__(self, path='clean_cache.sqlite', max_bytes=2 ** 30):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.db = sqlite3.connect(path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS cache ('
+                        'key BLOB PRIMARY KEY, value BLOB, size INTEGER, used REAL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS cache_used ON cache (used)')
+        self.hits = 0
+        self.misses = 0
+
+    def keys(self, abstracts):
+        prefix = config_fingerprint() + '\0'
+        return [sqlite3.Binary(sha1(prefix + a).digest()) for a in abstracts]
+
+    def lookup(self, keys):
+        '''
+        Returns a dict key -> cleaned abstract for the cached keys
+        '''
+        found = {}
+        for chunk in chunked(keys, 500):
+            query = 'SELECT key, value FROM cache WHERE key IN (%s)'
+            rows = self.db.execute(query % ','.join('?' * len(chunk)), chunk)
+            for key, value in rows:
+                found[str(key)] = zlib.decompress(value)
+        return found
+
+    def clean(self, abstracts, workers=1, chunksize=1000):
+        '''
+        Same as clean_all(abstracts)[0], cleaning only what is missing
+        '''
+        abstracts = list(abstracts)
+        keys = self.keys(abstracts)
+        found = self.lookup(keys)
+
+        missing = [i for i, key in enumerate(keys) if str(key) not in found]
+        cleaned, _ = clean_all([abstracts[i] for i in missing], False, workers, chunksize)
+        self.hits += len(abstracts) - len(missing)
+        self.misses += len(missing)
+        instrument.count('clean_cache.hits', len(abstracts) - len(missing))
+        instrument.count('clean_cache.misses', len(missing))
+
+        now = time.time()
+        rows = []
+        for i, clean_abstract in zip(missing, cleaned):
+            value = zlib.compress(clean_abstract)
+            found[str(keys[i])] = clean_abstract
+            rows.append((keys[i], sqlite3.Binary(value), len(value), now))
+        self.db.executemany('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)', rows)
+        for chunk in chunked(keys, 500):
+            query = 'UPDATE cache SET used = ? WHERE key IN (%s)'
+            self.db.execute(query % ','.join('?' * len(chunk)), [now] + chunk)
+        self.evict()
+        self.db.commit()
+
+        return [found[str(key)] for key in keys]
+
+    def size(self):
+        return self.db.execute('SELECT COALESCE(SUM(size), 0) FROM cache').fetchone()[0]
+
+    def evict(self):
+        '''
+        Drops the least recently used values until under max_bytes
+        '''
+        excess = self.size() - self.max_bytes
+        if excess <= 0:
+            return
+        evicted = []
+        for key, size in self.db.execute('SELECT key, size FROM cache ORDER BY used'):
+            evicted.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self.db.executemany('DELETE FROM cache WHERE key = ?', evicted)
+
+    def close(self):
+        self.db.close()
+
+
 def clean_up(abstract):
     '''
     Takes an abstract as input and cleans them up.
@@ -90,7 +278,48 @@ def clean_up(abstract):
     words = SEPARATOR_RE.split(abstract)
     words = filter(lambda x: len(x) > 1, words)
     words = filter(lambda x: x not in STOP_WORDS, words)
-    # words = map(porter_stem, words)
+    if STEM_WORDS:
+        words = stem_words(words)
     abstract = ' '.join(words)
 
     return abstract
+
+
+def tokenize(abstract, dictionary=None):
+    '''
+    Same output as clean_up(abstract).split(), without building the
+    cleaned string. The regex passes that only delete or split on single
+    characters are done with one str.translate each.
+    With a dictionary, returns the indices of the known words instead.
+    '''
+    abstract = abstract.lower()
+    abstract = URL_RE.sub('LINK', abstract)
+    abstract = CITE_RE.sub('CITE', abstract)
+    abstract = EQUATION_RE.sub('FORMULA', abstract)
+    abstract = abstract.translate(None, PUNCTUATION_CHARS)
+    abstract = STYLE1_RE.sub(r'\1', abstract)
+    abstract = STYLE2_RE.sub(r'\1', abstract)
+
+    # Brackets are deleted first, then the separators become spaces
+    abstract = abstract.translate(SEPARATOR_TABLE, BRACKET_CHARS)
+
+    words = [w for w in abstract.split(' ') if len(w) > 1 and w not in STOP_WORDS]
+    if STEM_WORDS:
+        words = stem_words(words)
+
+    # Words can still hold tabs or newlines, which split() breaks up
+    if WHITESPACE_RE.search(abstract):
+        words = [part for w in words for part in w.split()]
+
+    if dictionary is not None:
+        return [dictionary[w] for w in words if w in dictionary]
+    return words
+
+
+def tokenize_all(abstracts, dictionary=None):
+    '''
+    Yields tokenize(abstract, dictionary) for every abstract, e.g. to go
+    straight into transforms.build_csr(..., len(dictionary))
+    '''
+    for abstract in abstracts:
+        yield tokenize(abstract, dictionary)
@@ -0,0 +1,185 @@
+'''
+Local HTTP prediction service.
+
+Loads a classifier saved with Classifier.save once, cleans incoming
+abstracts with preprocessing.tokenize and coalesces concurrent requests
+into micro-batches for predict_batch.
+
+    python service.py model_file [--port 8000] [--max-batch 64] [--max-wait 2]
+
+    POST /predict   {"abstract": "..."}  ->  {"category": "...", "latency_ms": ...}
+    GET  /stats     latency percentiles and batch sizes
+'''
+from __future__ import division
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from collections import Counter, deque
+from classifiers import load_model, predict_examples
+from preprocessing import tokenize
+import argparse
+import threading
+import Queue
+import json
+import time
+
+
+class MicroBatcher(object):
+    '''
+    Collects examples from many threads and predicts them in batches.
+    A batch is sent to the classifier once it holds max_batch examples,
+    or max_wait seconds after its first example arrived.
+    '''
+    def __init__(self, classifier, max_batch=64, max_wait=0.002, history=10000):
+        self.classifier = classifier
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+
+        self.queue = Queue.Queue()
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=history)
+        self.batch_sizes = Counter()
+        self.request_count = 0
+
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def predict(self, example):
+        '''
+        Blocks until the batch holding example is predicted
+        '''
+        start = time.time()
+        request = [example, threading.Event(), None]
+        self.queue.put(request)
+        request[1].wait()
+        latency = time.time() - start
+
+        with self.lock:
+            self.latencies.append(latency)
+            self.request_count += 1
+
+        if isinstance(request[2], Exception):
+            raise request[2]
+        return request[2], latency
+
+    def next_batch(self):
+        batch = [self.queue.get()]
+        deadline = time.time() + self.max_wait
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self.queue.get_nowait())
+            except Queue.Empty:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                time.sleep(min(remaining, 0.0005))
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            examples = [request[0] for request in batch]
+            try:
+                if self.classifier.vocabulary is not None:
+                    examples = self.classifier.vectorize(examples)
+                guesses = predict_examples(self.classifier, examples)
+            except Exception as e:
+                guesses = [e] * len(batch)
+
+            with self.lock:
+                self.batch_sizes[len(batch)] += 1
+
+            for request, guess in zip(batch, guesses):
+                request[2] = guess
+                request[1].set()
+
+    def stats(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            batch_sizes = dict(self.batch_sizes)
+            request_count = self.request_count
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))] * 1000
+
+        batch_count = sum(batch_sizes.values())
+        return {
+            'requests': request_count,
+            'batches': batch_count,
+            'mean_batch_size': request_count / batch_count if batch_count else None,
+            'batch_sizes': batch_sizes,
+            'latency_ms': dict(('p%d' % p, percentile(p)) for p in (50, 90, 99, 100)),
+        }
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+
+    def send_json(self, code, data):
+        body = json.dumps(data)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self.send_json(200, self.server.batcher.stats())
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path != '/predict':
+            return self.send_json(404, {'error': 'not found'})
+
+        try:
+            length = int(self.headers.getheader('Content-Length', 0))
+            abstract = json.loads(self.rfile.read(length))['abstract']
+            if isinstance(abstract, unicode):
+                abstract = abstract.encode('utf-8')
+        except (ValueError, KeyError, TypeError):
+            return self.send_json(400, {'error': 'expected {"abstract": "..."}'})
+
+        try:
+            category, latency = self.server.batcher.predict(tokenize(abstract))
+        except Exception as e:
+            return self.send_json(500, {'error': '%s: %s' % (type(e).__name__, e)})
+        self.send_json(200, {'category': category, 'latency_ms': latency * 1000})
+
+    def log_message(self, format, *args):
+        pass  # one line per request would dominate the cost
+
+
+class PredictionServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, batcher):
+        HTTPServer.__init__(self, address, PredictionHandler)
+        self.batcher = batcher
+
+
+def serve(model_path, host='127.0.0.1', port=8000, max_batch=64, max_wait=0.002):
+    classifier = load_model(model_path)
+    batcher = MicroBatcher(classifier, max_batch, max_wait)
+    server = PredictionServer((host, port), batcher)
+    print "Serving %s on http://%s:%d" % (model_path, host, port)
+    try:
+        server.serve_forever()
+    finally:
+        print json.dumps(batcher.stats())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local prediction service')
+    parser.add_argument('model', help='file written by Classifier.save')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--max-batch', type=int, default=64)
+    parser.add_argument('--max-wait', type=float, default=2,
+                        help='milliseconds to wait for a batch to fill up')
+    args = parser.parse_args()
+    serve(args.model, args.host, args.port, args.max_batch, args.max_wait / 1000)
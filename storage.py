@@ -0,0 +1,112 @@
+'''
+Flat binary model files: a small JSON header followed by raw arrays
+(aligned to 64 bytes), so the arrays can be memory-mapped straight
+from the file and shared between processes through the page cache.
+'''
+import json
+import struct
+import numpy as np
+
+MAGIC = 'SAMODEL1'
+ALIGN = 64
+
+
+def align(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+def pack_words(words):
+    '''
+    Packs a list of words (without newlines) into a byte array
+    '''
+    return np.frombuffer('\n'.join(words), dtype=np.uint8)
+
+
+def unpack_words(array, count):
+    '''
+    Reverses pack_words
+    '''
+    if count == 0:
+        return []
+    return array.tostring().split('\n')
+
+
+def decode(value):
+    '''
+    json gives back unicode strings, the rest of the code uses str
+    '''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, list):
+        return map(decode, value)
+    if isinstance(value, dict):
+        return dict((decode(k), decode(v)) for k, v in value.items())
+    return value
+
+
+def write_model(path, header, arrays, vocabulary=None):
+    '''
+    Writes a header (anything json can store), a dict of numpy
+    arrays and optionally a vocabulary (list of words) to path
+    '''
+    arrays = dict(arrays)
+    if vocabulary is not None:
+        arrays['vocabulary'] = pack_words(vocabulary)
+        header = dict(header, vocabulary_size=len(vocabulary))
+
+    specs = []
+    offset = 0
+    for name in sorted(arrays):
+        arrays[name] = np.ascontiguousarray(arrays[name])
+        offset = align(offset)
+        specs.append({
+            'name': name,
+            'dtype': arrays[name].dtype.str,
+            'shape': arrays[name].shape,
+            'offset': offset,
+        })
+        offset += arrays[name].nbytes
+
+    blob = json.dumps(dict(header, arrays=specs))
+    data_start = align(len(MAGIC) + 8 + len(blob))
+
+    with open(path, 'wb') as fp:
+        fp.write(MAGIC)
+        fp.write(struct.pack('<Q', len(blob)))
+        fp.write(blob)
+        for spec in specs:
+            fp.seek(data_start + spec['offset'])
+            fp.write(arrays[spec['name']].tostring())
+        fp.truncate(align(data_start + offset))
+
+
+def read_model(path, mmap=True):
+    '''
+    Reads back what write_model wrote: returns header, arrays, vocabulary.
+    With mmap, arrays are copy-on-write views of the mapped file, so
+    loading costs next to nothing and the pages are shared.
+    '''
+    with open(path, 'rb') as fp:
+        assert fp.read(len(MAGIC)) == MAGIC, "not a model file: %s" % path
+        size, = struct.unpack('<Q', fp.read(8))
+        header = decode(json.loads(fp.read(size)))
+
+    data_start = align(len(MAGIC) + 8 + size)
+    if mmap:
+        data = np.memmap(path, dtype=np.uint8, mode='c')
+    else:
+        data = np.fromfile(path, dtype=np.uint8)
+
+    arrays = {}
+    for spec in header.pop('arrays'):
+        dtype = np.dtype(spec['dtype'])
+        start = data_start + spec['offset']
+        count = int(np.prod(spec['shape']))
+        array = data[start:start + count * dtype.itemsize].view(dtype)
+        arrays[spec['name']] = array.reshape(spec['shape'])
+
+    vocabulary = None
+    if 'vocabulary' in arrays:
+        vocabulary = unpack_words(arrays.pop('vocabulary'),
+                                  header.pop('vocabulary_size'))
+    return header, arrays, vocabulary
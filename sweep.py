@@ -0,0 +1,215 @@
+'''
+Cross validated hyperparameter sweeps that share work between grid points.
+
+For each fold, the word counts and the IG ranking of the train part are
+computed once, so every (min_count, IG_fraction) pair is only a column
+mask. One NaiveBayes count table per fold and mask scores every penalty
+(the scores are A - penalty * B, with A and B computed once), and one
+AdaBoost_SAMME fit with the largest n_iter scores every smaller n_iter
+through staged_score. The tasks (one per fold and mask for NaiveBayes,
+one per fold, mask and ratio for boosting) run on a process pool.
+
+    python sweep.py --penalty 0 5 10 15 18 20 25 30 --IG-fraction 0 0.05 0.06
+
+min_count and IG_fraction play the role of preprocess's rare word cutoff
+and the IG pruning of the part scripts (the share of words with the
+lowest IG that is dropped), computed on the train part of each fold.
+'''
+from __future__ import division
+from multiprocessing import cpu_count
+from classifiers import AdaBoost_SAMME, DecisionStump, NaiveBayes
+from classifiers import information_gain, weighted_counts
+from corpus import as_matrix
+from utils import KFold, map_shared, shared_data
+import instrument
+import numpy as np
+import argparse
+import random
+import csv
+
+COLUMNS = ['model', 'min_count', 'IG_fraction', 'penalty', 'ratio', 'n_iter',
+           'mean_success_rate', 'std_success_rate', 'folds']
+
+def fold_statistics(X, rows, class_total, train_indices, test_indices):
+    '''
+    Word counts and IG of every word, on the train part of a fold
+    '''
+    feature_count, class_count = weighted_counts(X[train_indices], rows[train_indices],
+                                                 class_total)
+    return {
+        'train': train_indices,
+        'test': test_indices,
+        'word_count': feature_count.sum(axis=1),
+        'IG': information_gain(feature_count, class_count),
+    }
+
+
+def kept_words(fold, min_count, IG_fraction):
+    '''
+    Column indices kept by a rare word cutoff followed by dropping the
+    IG_fraction of the remaining words with the lowest IG
+    '''
+    kept = np.flatnonzero(fold['word_count'] >= min_count)
+    drop = int(len(kept) * IG_fraction)
+    if drop:
+        kept = np.sort(kept[np.argsort(fold['IG'][kept], kind='mergesort')[drop:]])
+    return kept
+
+
+def naive_bayes_task(args):
+    '''
+    Scores every penalty for one fold and mask.
+    Returns (parameters, success rate) pairs.
+    The shared data (see utils.map_shared) is (X, rows, classes, folds),
+    where folds holds the train/test indices, word counts and IG of
+    each fold.
+    '''
+    fold_index, min_count, IG_fraction, penalties = args
+    X, rows, classes, folds = shared_data()
+    fold = folds[fold_index]
+    kept = kept_words(fold, min_count, IG_fraction)
+
+    with instrument.stage('sweep.naive_bayes', items=len(penalties)):
+        model = NaiveBayes()
+        model.fit_matrix(X[fold['train']][:, kept], rows[fold['train']])
+        model.normalize()
+
+        # predict_batch's scores, split in two
+        test = X[fold['test']][:, kept]
+        actual = rows[fold['test']]
+        known = test * model.feature_log_prob.T + model.class_log_prior
+        unseen = test * model.unseen_known.T
+        label = np.array(model.classes)
+
+        results = []
+        for penalty in penalties:
+            guesses = label[np.asarray(known - penalty * unseen).argmax(axis=1)]
+            params = {'model': 'NaiveBayes', 'min_count': min_count,
+                      'IG_fraction': IG_fraction, 'penalty': penalty}
+            results.append((params, (guesses == actual).mean()))
+    return results
+
+
+def adaboost_task(args):
+    '''
+    Fits AdaBoost_SAMME once with the largest n_iter for one fold, mask
+    and stump ratio, and scores every n_iter
+    '''
+    fold_index, min_count, IG_fraction, ratio, n_iters, seed = args
+    X, rows, classes, folds = shared_data()
+    fold = folds[fold_index]
+    kept = kept_words(fold, min_count, IG_fraction)
+    random.seed(seed)
+
+    def make_stump():
+        stump = DecisionStump()
+        stump.ratio = ratio
+        return stump
+
+    with instrument.stage('sweep.adaboost', items=max(n_iters)):
+        model = AdaBoost_SAMME(n_iter=max(n_iters), weak_learner=make_stump)
+        model.fit(X[fold['train']][:, kept], list(rows[fold['train']]))
+        scores = model.staged_score(list(rows[fold['test']]), X[fold['test']][:, kept])
+
+    results = []
+    for n_iter in n_iters:
+        params = {'model': 'AdaBoost_SAMME', 'min_count': min_count,
+                  'IG_fraction': IG_fraction, 'ratio': ratio, 'n_iter': n_iter}
+        results.append((params, scores[min(n_iter, len(scores)) - 1]))
+    return results
+
+
+def sweep(examples, categories, min_count=(3,), IG_fraction=(0,), penalty=(18,),
+          ratio=(0.88,), n_iter=(1,), models=('NaiveBayes', 'AdaBoost_SAMME'),
+          k=5, workers=1, shuffle=False, stratified=False, seed=0,
+          output_path='sweep_results.csv'):
+    '''
+    Cross validates every combination of the given values, for each
+    model (NaiveBayes uses penalty, AdaBoost_SAMME uses ratio and n_iter),
+    with the folds of cross_validate (k, shuffle, stratified, seed).
+    examples are unpruned: a Corpus or a document-term count matrix.
+    Returns one row (dict) per grid point, best first, and writes them
+    as a table to output_path.
+    '''
+    assert min(min_count) >= 1, "min_count must be at least 1"
+    X = as_matrix(examples).tocsr()
+    assert X.shape[0] == len(categories), "input/output size mismatch"
+
+    classes = sorted(set(categories))
+    mapping = dict((c, i) for i, c in enumerate(classes))
+    rows = np.array([mapping[c] for c in categories], dtype=int)
+
+    with instrument.stage('sweep.fold_statistics', items=k):
+        folds = [fold_statistics(X, rows, len(classes), np.asarray(train), np.asarray(test))
+                 for train, test in KFold(categories, k, shuffle, stratified, seed)]
+
+    tasks = []
+    for i in range(k):
+        for count in min_count:
+            for fraction in IG_fraction:
+                if 'NaiveBayes' in models:
+                    tasks.append((naive_bayes_task, (i, count, fraction, list(penalty))))
+                if 'AdaBoost_SAMME' in models:
+                    for r in ratio:
+                        tasks.append((adaboost_task,
+                                      (i, count, fraction, r, list(n_iter), seed + i)))
+
+    fold_scores = {}
+    for results in map_shared(tasks, (X, rows, classes, folds), workers):
+        for params, score in results:
+            key = tuple(params.get(c) for c in COLUMNS[:6])
+            fold_scores.setdefault(key, []).append(score)
+
+    table = []
+    for key, scores in fold_scores.items():
+        row = dict(zip(COLUMNS[:6], key))
+        row['mean_success_rate'] = np.mean(scores)
+        row['std_success_rate'] = np.std(scores)
+        row['folds'] = len(scores)
+        table.append(row)
+    table.sort(key=lambda row: -row['mean_success_rate'])
+
+    if output_path:
+        write_table(table, output_path)
+    return table
+
+
+def write_table(table, output_path='sweep_results.csv'):
+    with open(output_path, 'w') as fp:
+        writer = csv.writer(fp)
+        writer.writerow(COLUMNS)
+        for row in table:
+            writer.writerow(['' if row[c] is None else row[c] for c in COLUMNS])
+
+
+def print_table(table, top=20):
+    print "%-15s %9s %11s %8s %6s %6s %8s %8s" % tuple(COLUMNS[:8])
+    for row in table[:top]:
+        values = ['-' if row[c] is None else row[c] for c in COLUMNS[:6]]
+        print "%-15s %9s %11s %8s %6s %6s %8.4f %8.4f" % tuple(
+            values + [row['mean_success_rate'], row['std_success_rate']])
+
+
+if __name__ == '__main__':
+    from preprocessing import CleanCache, preprocess
+    from corpus import Corpus
+    from utils import load_train_data
+
+    parser = argparse.ArgumentParser(description='Cross validated parameter sweep')
+    parser.add_argument('--models', nargs='+', default=['NaiveBayes', 'AdaBoost_SAMME'])
+    parser.add_argument('--min-count', type=int, nargs='+', default=[1, 2, 3, 4, 5])
+    parser.add_argument('--IG-fraction', type=float, nargs='+', default=[0, 0.05, 0.06])
+    parser.add_argument('--penalty', type=float, nargs='+', default=range(0, 51))
+    parser.add_argument('--ratio', type=float, nargs='+', default=[0.8, 0.85, 0.88, 0.9, 0.95])
+    parser.add_argument('--n-iter', type=int, nargs='+', default=[1, 2, 5, 10])
+    parser.add_argument('-k', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=cpu_count())
+    parser.add_argument('--output', default='sweep_results.csv')
+    args = parser.parse_args()
+
+    abstracts, categories = load_train_data()
+    examples = Corpus.from_abstracts(preprocess(abstracts, cache=CleanCache()))
+    table = sweep(examples, categories, args.min_count, args.IG_fraction, args.penalty,
+                  args.ratio, args.n_iter, args.models, args.k, args.workers,
+                  output_path=args.output)
+    print_table(table)
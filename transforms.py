@@ -1,28 +1,17 @@
 from __future__ import division
+from array import array
 from scipy.sparse import *
+from zlib import crc32
+from corpus import Corpus, build_dictionary
 import numpy as np
 
-# ---------------
-# Helpful methods
-# ---------------
-
-
-def build_dictionary(abstracts):
-    '''
-    Returns a mapping of all the words in dataset to an index
-    '''
-    all_words = set()
-    for abstract in abstracts:
-        words = abstract.split(' ')
-        all_words.update(words)
-    return dict((v, i) for i, v in enumerate(all_words))
-
-
 # ---------------
 # Bag of Words
 # ---------------
 
 def bag_of_words(abstracts):
+    if isinstance(abstracts, Corpus):
+        return abstracts.to_matrix()
     dictionary = build_dictionary(abstracts)
     return create_bow_matrix(abstracts, dictionary)
 
@@ -31,12 +20,62 @@ def create_bow_matrix(abstracts, dictionary):
     '''
     Returns matrix of size len(abstracts) x len(dictionary).
     For each abstract, a vector of the counts of all words in the dictionary.
+    Words that are not in the dictionary are dropped.
+    abstracts can also be a Corpus.
     '''
-    bow_matrix = dok_matrix((len(abstracts), len(dictionary)))
-    for i, abstract in enumerate(abstracts):
-        for word in abstract.split(' '):
-            bow_matrix[i, dictionary[word]] += 1
-    return bow_matrix.tocsr()
+    if isinstance(abstracts, Corpus):
+        return abstracts.to_matrix(dictionary)
+
+    def word_indices(abstract):
+        return [dictionary[w] for w in abstract.split(' ') if w in dictionary]
+    return build_csr(map(word_indices, abstracts), len(dictionary))
+
+
+def hash_word(word, n_features):
+    '''
+    Maps a word to a column index, stable across runs and interpreters
+    '''
+    return (crc32(word) & 0xffffffff) % n_features
+
+
+def hashed_bag_of_words(abstracts, n_features=2 ** 20):
+    '''
+    Same as bag_of_words, but words are hashed into n_features columns
+    instead of looked up in a dictionary. Needs no fitting, so it works
+    on streams and with an unbounded vocabulary (at the cost of collisions).
+    '''
+    def word_indices(abstract):
+        return [hash_word(w, n_features) for w in abstract.split(' ')]
+    return build_csr(map(word_indices, abstracts), n_features)
+
+
+def build_csr(rows, n_cols):
+    '''
+    Builds a CSR count matrix from an iterable of column index lists
+    (one list per row, repeated indices are summed).
+    '''
+    indptr = array('i', [0])
+    indices = array('i')
+    for row in rows:
+        indices.extend(row)
+        indptr.append(len(indices))
+
+    data = np.ones(len(indices))
+    matrix = csr_matrix((data, np.frombuffer(indices, dtype=np.intc),
+                         np.frombuffer(indptr, dtype=np.intc)),
+                        shape=(len(indptr) - 1, n_cols))
+    matrix.sum_duplicates()
+    return matrix
+
+
+def document_frequency(bow_matrix):
+    '''
+    Returns the number of documents (rows) each word (column) appears in.
+    These are just the non-zero counts of the columns.
+    '''
+    bow_matrix = csr_matrix(bow_matrix)
+    bow_matrix.eliminate_zeros()
+    return np.bincount(bow_matrix.indices, minlength=bow_matrix.shape[1])
 
 
 # ---------------
@@ -49,10 +88,19 @@ def tf(abstracts, dictionary):
     (How frequently a term occurs in a document.)
     Normalized by document length.
     '''
-    tf = create_bow_matrix(abstracts, dictionary)
-    abstract_sizes = [abstract.count(' ') + 1 for abstract in abstracts]
+    return tf_from_counts(create_bow_matrix(abstracts, dictionary), abstracts)
+
+
+def tf_from_counts(bow_matrix, abstracts):
+    '''
+    Same as tf, for an already built bag of words matrix
+    '''
+    if isinstance(abstracts, Corpus):
+        abstract_sizes = np.maximum(abstracts.lengths(), 1)
+    else:
+        abstract_sizes = [abstract.count(' ') + 1 for abstract in abstracts]
     scale_factor = diags([[1/s for s in abstract_sizes]], [0])
-    return scale_factor * tf
+    return scale_factor * bow_matrix
 
 
 def idf(abstracts, dictionary):
@@ -61,13 +109,20 @@ def idf(abstracts, dictionary):
     (How important a term is -- a vector of length len(dictionary))
     log(Total number of documents / Number of documents with term in it).
     '''
-    doc_count = np.zeros(len(dictionary))
-    for i, word in enumerate(dictionary):
-        for abstract in abstracts:
-            if word in abstract:
-                doc_count[i] += 1
-    scale = np.log(len(abstracts) / doc_count)
-    return diags([scale], [0])
+    bow_matrix = create_bow_matrix(abstracts, dictionary)
+    return diags([idf_from_counts(bow_matrix)], [0])
+
+
+def idf_from_counts(bow_matrix):
+    '''
+    Returns the IDF vector of an already built bag of words matrix.
+    Words that never appear get a weight of 0.
+    '''
+    doc_count = document_frequency(bow_matrix)
+    scale = np.zeros(len(doc_count))
+    present = doc_count > 0
+    scale[present] = np.log(bow_matrix.shape[0] / doc_count[present])
+    return scale
 
 
 def tf_idf(abstracts):
@@ -75,10 +130,125 @@ def tf_idf(abstracts):
     Returns the TF-IDF features representation of abstracts.
     This should only be used on preprocessed abstracts.
     '''
-    dictionary = build_dictionary(abstracts)
-    return tf(abstracts, dictionary) * idf(abstracts, dictionary)
+    return TfidfTransformer().fit_transform(abstracts)
+
+
+class TfidfTransformer(object):
+    '''
+    TF-IDF features with a dictionary and IDF vector fitted on the train
+    abstracts, so that test abstracts get the exact same columns.
+    Words that were not seen during fit are dropped.
+    '''
+    def fit(self, abstracts):
+        self.fit_transform(abstracts)
+        return self
+
+    def fit_transform(self, abstracts):
+        if isinstance(abstracts, Corpus):
+            self.dictionary = abstracts.dictionary
+        else:
+            self.dictionary = build_dictionary(abstracts)
+        bow_matrix = create_bow_matrix(abstracts, self.dictionary)
+        self.idf = idf_from_counts(bow_matrix)
+        return tf_from_counts(bow_matrix, abstracts) * diags([self.idf], [0])
+
+    def transform(self, abstracts):
+        return tf(abstracts, self.dictionary) * diags([self.idf], [0])
 
 
 # ----------------------------
 # Relevance-frequency features
 # ----------------------------
+
+def class_document_frequency(bow_matrix, outputs):
+    '''
+    Returns the classes and a class x word array of the number of
+    documents of each class each word appears in, from one sparse product
+    '''
+    bow_matrix = csr_matrix(bow_matrix)
+    example_count = bow_matrix.shape[0]
+    assert example_count == len(outputs), "input/output size mismatch"
+
+    classes = sorted(set(outputs))
+    mapping = dict((c, i) for i, c in enumerate(classes))
+    rows = np.array([mapping[c] for c in outputs], dtype=int)
+
+    present = csr_matrix(((bow_matrix.data != 0).astype(float),
+                          bow_matrix.indices, bow_matrix.indptr),
+                         shape=bow_matrix.shape)
+    indicator = csr_matrix((np.ones(example_count), (rows, np.arange(example_count))),
+                           shape=(len(classes), example_count))
+    return classes, (indicator * present).toarray()
+
+
+def relevance_frequency(class_doc_count):
+    '''
+    One-vs-rest relevance frequency of every word for every class:
+    rf = log2(2 + a / max(1, c)), with a the number of documents of the
+    class containing the word and c that of all the other classes
+    '''
+    other_doc_count = class_doc_count.sum(axis=0) - class_doc_count
+    return np.log2(2 + class_doc_count / np.maximum(1, other_doc_count))
+
+
+def scale_columns(matrix, weights, copy=True):
+    '''
+    matrix * diags(weights) for a CSR matrix, done on its data array
+    '''
+    matrix = csr_matrix(matrix, copy=copy)
+    if matrix.dtype.kind != 'f':
+        matrix = matrix.astype(float)
+    matrix.data *= weights[matrix.indices]
+    return matrix
+
+
+def normalize_rows(matrix):
+    '''
+    Scales the rows of a CSR matrix to unit L2 norm, in place
+    '''
+    norms = np.sqrt(np.bincount(np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr)),
+                                weights=matrix.data ** 2, minlength=matrix.shape[0]))
+    norms[norms == 0] = 1
+    matrix.data /= np.repeat(norms, np.diff(matrix.indptr))
+    return matrix
+
+
+class RfTransformer(object):
+    '''
+    tf.rf term weighting: supervised counterpart of the IDF in
+    TfidfTransformer. fit(X, y) computes the one-vs-rest relevance
+    frequency of every column (word) for every class; transform(X)
+    multiplies the columns of a tf or count matrix by the largest of
+    those (or by one class's, for a one-vs-rest classifier of that
+    class). Works on sparse matrices only, without densifying, so it fits
+    in an sklearn Pipeline as well as in front of the classifiers'
+    fit_matrix / predict_batch. norm='l2' rescales every row afterwards.
+    '''
+    def __init__(self, norm=None):
+        self.norm = norm
+
+    def fit(self, X, y):
+        self.classes, class_doc_count = class_document_frequency(X, y)
+        self.rf = relevance_frequency(class_doc_count)
+        self.weights = self.rf.max(axis=0)
+        return self
+
+    def transform(self, X, category=None, copy=True):
+        '''
+        Columns past the fitted ones (unseen words) are dropped
+        '''
+        X = csr_matrix(X)
+        if X.shape[1] > len(self.weights):
+            X = X[:, :len(self.weights)]
+            copy = False
+        if category is None:
+            weights = self.weights
+        else:
+            weights = self.rf[self.classes.index(category)]
+        X = scale_columns(X, weights[:X.shape[1]], copy)
+        if self.norm == 'l2':
+            normalize_rows(X)
+        return X
+
+    def fit_transform(self, X, y):
+        return self.fit(X, y).transform(X)
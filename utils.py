@@ -1,6 +1,16 @@
 from __future__ import division
 from collections import Counter, defaultdict
+from itertools import islice, izip_longest
+from multiprocessing import Pool
+from scipy.sparse import issparse
+from classifiers import NaiveBayes, fit_examples, predict_examples
+from classifiers import information_gain, weighted_counts
+from corpus import Corpus, is_matrix
+from transforms import hash_word
+import instrument
+import numpy as np
 import math
+import time
 import csv
 
 
@@ -8,54 +18,307 @@ class CrossValidation(object):
     '''
     Iterator that returns 1/k of the data as test data and
     the rest as train data, for every of the k pieces.
+    Folds come from KFold (see there for shuffle and stratified).
     '''
-    def __init__(self, examples, outputs, k=10):
+    def __init__(self, examples, outputs, k=10, shuffle=False,
+                 stratified=False, seed=0):
         assert len(examples) == len(outputs)
 
         self.examples = examples
         self.outputs = outputs
-        self.k = len(outputs) // k
-        self.i = 0
+        self.folds = iter(KFold(outputs, k, shuffle, stratified, seed))
 
     def __iter__(self):
         return self
 
     def next(self):
-        s, e = self.i * self.k, (self.i + 1) * self.k
-        if s >= len(self.examples):
-            raise StopIteration
-        self.i += 1
+        train_indices, test_indices = next(self.folds)
 
-        train_data = self.examples[:s] + self.examples[e:]
-        train_result = self.outputs[:s] + self.outputs[e:]
+        train_data = take(self.examples, train_indices)
+        train_result = take(self.outputs, train_indices)
 
-        test_data = self.examples[s:e]
-        test_result = self.outputs[s:e]
+        test_data = take(self.examples, test_indices)
+        test_result = take(self.outputs, test_indices)
 
         return train_data, train_result, test_data, test_result
 
 
+class KFold(object):
+    '''
+    Splits example indices in k folds without touching the data.
+    Iterating gives (train_indices, test_indices) arrays for every fold.
+    shuffle randomizes which examples go together, stratified keeps
+    the class proportions of every fold close to those of outputs.
+    '''
+    def __init__(self, outputs, k=10, shuffle=False, stratified=False, seed=0):
+        example_count = len(outputs)
+        self.k = k
+
+        order = np.arange(example_count)
+        if shuffle:
+            np.random.RandomState(seed).shuffle(order)
+
+        self.fold_of = np.empty(example_count, dtype=int)
+        if stratified:
+            # Deal the examples of each class round robin over the folds
+            order = sorted(order, key=lambda i: outputs[i])
+            self.fold_of[order] = np.arange(example_count) % k
+        else:
+            for fold, (s, e) in enumerate(fold_bounds(example_count, k)):
+                self.fold_of[order[s:e]] = fold
+
+    def __iter__(self):
+        for fold in range(self.k):
+            in_fold = self.fold_of == fold
+            yield np.flatnonzero(~in_fold), np.flatnonzero(in_fold)
+
+
+def take(items, indices):
+    '''
+    Returns the items (list or sparse matrix rows) at the given indices
+    '''
+    if is_matrix(items):
+        return items[indices]
+    return [items[i] for i in indices]
+
+
+# Data of the running map_shared call, see shared_data.
+SHARED_DATA = None
+
+
+def shared_data():
+    '''
+    The data given to the running map_shared call, for its tasks
+    '''
+    return SHARED_DATA
+
+
+def run_shared(args):
+    task, task_args = args
+    trace_start = instrument.mark()
+    result = task(task_args)
+    events = instrument.events_since(trace_start) if instrument.ENABLED else []
+    return result, events
+
+
+def map_shared(tasks, data, workers=1):
+    '''
+    Runs (function, args) tasks in a process pool of size workers and
+    returns the function(args) results, in task order. The functions read
+    data through shared_data(): pool workers inherit it through fork, so
+    it is never pickled and only the args and results cross process
+    boundaries. The workers' instrument events are added to this process.
+    '''
+    global SHARED_DATA
+    SHARED_DATA = data
+    try:
+        if workers > 1:
+            pool = Pool(workers)
+            try:
+                outputs = pool.map(run_shared, tasks, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            outputs = map(run_shared, tasks)
+    finally:
+        SHARED_DATA = None
+
+    results = []
+    for result, events in outputs:
+        instrument.absorb(events)
+        results.append(result)
+    return results
+
+
+def run_fold(args):
+    '''
+    Fits and scores one fold of cross_validate, whose
+    (examples, outputs, make_classifier) are the shared data
+    '''
+    fold, train_indices, test_indices, train_score = args
+    examples, outputs, make_classifier = shared_data()
+
+    train_data = take(examples, train_indices)
+    train_result = take(outputs, train_indices)
+    test_data = take(examples, test_indices)
+    test_result = take(outputs, test_indices)
+
+    start = time.time()
+    classifier = make_classifier()
+    fit_examples(classifier, train_data, train_result)
+    fit_time = time.time() - start
+
+    def success_rate(data, result):
+        guesses = predict_examples(classifier, data)
+        correct = sum(1 for a, b in zip(guesses, result) if a == b)
+        return correct / len(result), guesses
+
+    start = time.time()
+    ratio, guesses = success_rate(test_data, test_result)
+    predict_time = time.time() - start
+
+    output = {
+        'fold': fold,
+        'success_rate': ratio,
+        'test_indices': test_indices,
+        'predictions': guesses,
+        'fit_time': fit_time,
+        'predict_time': predict_time,
+    }
+    if train_score:
+        output['train_success_rate'] = success_rate(train_data, train_result)[0]
+    return output
+
+
+def cross_validate(make_classifier, examples, outputs, k=10, workers=1,
+                   shuffle=False, stratified=False, seed=0, train_score=False):
+    '''
+    Runs k-fold cross validation of make_classifier() (a class, or any
+    function returning an unfitted classifier), with the folds running in
+    a process pool of size workers. Only fold indices and results cross
+    process boundaries. Returns one dict per fold, in fold order, with
+    the success rate, predictions and fit/predict timings.
+    '''
+    example_count = examples.shape[0] if issparse(examples) else len(examples)
+    assert example_count == len(outputs), "input/output size mismatch"
+
+    kfold = KFold(outputs, k, shuffle, stratified, seed)
+    folds = [(run_fold, (i, train_indices, test_indices, train_score))
+             for i, (train_indices, test_indices) in enumerate(kfold)]
+    return map_shared(folds, (examples, outputs, make_classifier), workers)
+
+
+def fold_bounds(example_count, k):
+    '''
+    Returns the (start, end) indices of k contiguous folds
+    covering all examples, with sizes differing by at most one
+    '''
+    size, extra = divmod(example_count, k)
+    bounds = []
+    start = 0
+    for i in range(k):
+        end = start + size + (1 if i < extra else 0)
+        bounds.append((start, end))
+        start = end
+    return bounds
+
+
+def count_folds(examples, outputs, k=10, model_class=NaiveBayes):
+    '''
+    Cross validation for count based models (e.g. NaiveBayes).
+    Each fold's examples are counted once into their own model; the train
+    model of a fold is then the total of all counts minus that fold's.
+    Yields train_model, test_data, test_result for each fold.
+    examples can be lists of words, a sparse document-term matrix or a Corpus.
+    '''
+    matrix = is_matrix(examples)
+    example_count = examples.shape[0] if issparse(examples) else len(examples)
+    assert example_count == len(outputs), "input/output size mismatch"
+
+    fold_models = []
+    total = model_class()
+    for s, e in fold_bounds(example_count, k):
+        model = model_class()
+        with instrument.stage('count_folds.count', items=e - s):
+            if matrix:
+                model.partial_fit_matrix(examples[s:e], outputs[s:e])
+            else:
+                model.partial_fit(examples[s:e], outputs[s:e])
+            total.merge(model)
+        fold_models.append((model, s, e))
+
+    for model, s, e in fold_models:
+        train_model = total.copy().subtract(model)
+        yield train_model, examples[s:e], outputs[s:e]
+
+
+def count_cross_validate(examples, outputs, k=10, model_class=NaiveBayes):
+    '''
+    Runs count_folds and returns the success rate of each fold
+    together with all the predictions (in example order)
+    '''
+    success_rates = []
+    predictions = []
+    for model, test_data, test_result in count_folds(examples, outputs, k, model_class):
+        guesses = predict_examples(model, test_data)
+        correct = sum(1 for a, b in zip(guesses, test_result) if a == b)
+        success_rates.append(correct / len(test_result))
+        predictions.extend(guesses)
+    return success_rates, predictions
+
+
 def compute_IG(examples, categories, weights=None):
     '''
     Computes the entropy of each feature
     '''
+    with instrument.stage('compute_IG', items=len(categories)):
+        if isinstance(examples, Corpus):
+            IG = compute_IG_matrix(examples, categories, weights)
+            return defaultdict(float, zip(examples.vocabulary, IG))
+
+        weights = weights or [1 for i in examples]
+
+        class_count = defaultdict(float)
+        feature_count = defaultdict(lambda: defaultdict(float))
+        for example, category, w in zip(examples, categories, weights):
+            class_count[category] += w
+            for feature in example:
+                feature_count[feature][category] += w
+
+        return IG_from_counts(class_count, feature_count)
+
+
+def compute_IG_matrix(X, categories, weights=None):
+    '''
+    Same as compute_IG, but for a document-term matrix (e.g. from
+    transforms.create_bow_matrix). Returns an array of IG values
+    aligned with the columns; words that never appear get 0.
+    '''
+    classes = list(set(categories))
+    mapping = dict((c, i) for i, c in enumerate(classes))
+    rows = np.array([mapping[c] for c in categories], dtype=int)
+
+    feature_count, class_count = weighted_counts(X, rows, len(classes), weights)
+    IG = information_gain(feature_count, class_count)
+    IG[feature_count.sum(axis=1) == 0] = 0
+    return IG
+
+
+def model_IG(model):
+    '''
+    Computes compute_IG's output straight from the counts of a fitted
+    NaiveBayes model, e.g. the train models given by count_folds.
+    For a model fit on a matrix or a Corpus, returns compute_IG_matrix's
+    output instead: an array aligned with the columns (the vocabulary).
+    '''
+    if len(model.classes):
+        feature_count = model.class_feature_count.T
+        IG = information_gain(feature_count, model.class_doc_count)
+        IG[feature_count.sum(axis=1) == 0] = 0
+        return IG
+
+    feature_count = defaultdict(dict)
+    for category, counts in model.feature_count.items():
+        for feature, count in counts.items():
+            feature_count[feature][category] = count
+    return IG_from_counts(model.class_count, feature_count)
 
-    weights = weights or [1 for i in examples]
+
+def IG_from_counts(class_count, feature_count):
+    '''
+    Computes the entropy of each feature from the number of examples
+    per class and the feature -> class -> count table
+    '''
+    example_count = sum(class_count.values())
 
     entropy = 0
-    class_count = Counter(categories)
     for count in class_count.values():
-        ratio = count / len(categories)
+        ratio = count / example_count
         entropy -= ratio * math.log(ratio, 2)
 
-    all_features = set(f for example in examples for f in example)
-    feature_count = defaultdict(lambda: defaultdict(float))
-    for example, category, w in zip(examples, categories, weights):
-        for feature in example:
-            feature_count[feature][category] += w
-
     IG = defaultdict(float)
-    for feature in all_features:
+    for feature in feature_count:
         branch_count = sum(feature_count[feature].values())
 
         true_entropy = 0
@@ -65,7 +328,7 @@ def compute_IG(examples, categories, weights=None):
 
         false_entropy = 0
         for category in feature_count[feature]:
-            false_total = len(examples) - branch_count
+            false_total = example_count - branch_count
             true_count = feature_count[feature][category]
             false_count = class_count[category] - true_count
             ratio = false_count / false_total
@@ -73,8 +336,8 @@ def compute_IG(examples, categories, weights=None):
                 false_entropy += ratio * math.log(ratio, 2)
 
         IG[feature] = entropy
-        IG[feature] += true_entropy * branch_count / len(examples)
-        IG[feature] += false_entropy * (1 - branch_count / len(examples))
+        IG[feature] += true_entropy * branch_count / example_count
+        IG[feature] += false_entropy * (1 - branch_count / example_count)
 
     return IG
 
@@ -98,22 +361,71 @@ def print_CC(actual, predicted):
         print "{:8}| {}".format(c1, ' '.join(row))
 
 
-def build_dictionary(abstracts):
+def ngrams(words, ngram_range=(1, 1)):
     '''
-    Returns a mapping of all the words in dataset to an index
+    Returns the n-grams of a list of words for every n of ngram_range
+    (both ends included), as strings of words joined by spaces
     '''
-    all_words = set()
-    for abstract in abstracts:
-        words = abstract.split(' ')
-        all_words.update(words)
-    return dict((v, i) for i, v in enumerate(all_words))
+    low, high = ngram_range
+    features = list(words) if low <= 1 else []
+    for n in range(max(low, 2), high + 1):
+        features.extend([' '.join(words[i:i + n]) for i in xrange(len(words) - n + 1)])
+    return features
 
 
-def extract_features(abstracts):
+def extract_features(abstracts, ngram_range=(1, 1), n_features=None, min_count=1):
     '''
-    Converts an abstract paragraph to a list of features (words)
+    Converts an abstract paragraph to a list of features (words).
+    ngram_range=(1, 2) adds the bigrams ('word1 word2') and so on.
+    With n_features, every feature is hashed into an int below n_features
+    (see transforms.hash_word), which bounds the number of features the
+    classifiers have to store, whatever the vocabulary.
+    Features seen less than min_count times over all abstracts are
+    dropped; they are counted in a first pass that stores no features
+    (with hashing, in an array of n_features counts).
     '''
-    return map(str.split, abstracts)
+    def features(abstract):
+        words = abstract.split()
+        if ngram_range != (1, 1):
+            words = ngrams(words, ngram_range)
+        if n_features:
+            return [hash_word(w, n_features) for w in words]
+        return words
+
+    with instrument.stage('extract_features') as stage:
+        if ngram_range == (1, 1) and not n_features and min_count <= 1:
+            examples = map(str.split, abstracts)
+            stage.add(len(examples))
+            return examples
+
+        if min_count <= 1:
+            examples = map(features, abstracts)
+            stage.add(len(examples))
+            return examples
+
+        # the abstracts are read twice
+        if iter(abstracts) is abstracts:
+            abstracts = list(abstracts)
+        stage.add(len(abstracts))
+
+        if n_features:
+            counts = np.zeros(n_features, dtype=int)
+            for chunk in chunked(abstracts, 1000):
+                ids = [i for abstract in chunk for i in features(abstract)]
+                counts += np.bincount(np.array(ids, dtype=int), minlength=n_features)
+            kept = counts >= min_count
+            stage.set(features=int((counts > 0).sum()), kept=int(kept.sum()))
+            keep = bytearray(kept)
+            del counts, kept
+            return [[i for i in features(abstract) if keep[i]] for abstract in abstracts]
+
+        word_count = Counter()
+        for abstract in abstracts:
+            word_count.update(features(abstract))
+        keep = set(w for w, c in word_count.iteritems() if c >= min_count)
+        stage.set(features=len(word_count), kept=len(keep))
+        del word_count
+        return [[w for w in features(abstract) if w in keep] for abstract in abstracts]
 
 
 def compress_classes(categories):
@@ -126,26 +438,59 @@ def compress_classes(categories):
     return output, classes
 
 
-def load_train_data():
+def chunked(iterable, size):
     '''
-    Loads the set of train data and results
+    Groups an iterable into lists of (at most) size items
     '''
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
 
-    with open('train_input.csv') as fp:
-        reader = csv.reader(fp)
-        train_input = list(reader)[1:]
-
-    with open('train_output.csv') as fp:
-        reader = csv.reader(fp)
-        train_output = list(reader)[1:]
 
-    abstracts = map(lambda x: x[1], train_input)
-    categories = map(lambda x: x[1], train_output)
+def iter_train_data(input_path='train_input.csv',
+                    output_path='train_output.csv'):
+    '''
+    Streams (id, abstract, category) records from the train files,
+    joining the input and output files row by row (their ids must match
+    and they must have as many rows)
+    '''
+    with open(input_path) as fp_in, open(output_path) as fp_out:
+        rows = izip_longest(csv.reader(fp_in), csv.reader(fp_out))
+        next(rows, None)  # skip header
+        for input_row, output_row in rows:
+            assert None not in (input_row, output_row), "input/output size mismatch"
+            (rid, abstract), (output_id, category) = input_row, output_row
+            assert rid == output_id, "input/output id mismatch: %s != %s" % (rid, output_id)
+            if category == "category":  # header of a concatenated file
+                continue
+            yield rid, abstract, category
+
+
+def iter_test_data(input_path='test_input.csv'):
+    '''
+    Streams (id, abstract) records from the test file
+    '''
+    with open(input_path) as fp:
+        rows = csv.reader(fp)
+        next(rows, None)  # skip header
+        for rid, abstract in rows:
+            if abstract == "abstract":  # header of a concatenated file
+                continue
+            yield rid, abstract
 
-    bad_indices = set(i for i, c in enumerate(categories) if c == "category")
-    abstracts = [a for i, a in enumerate(abstracts) if i not in bad_indices]
-    categories = [c for i, c in enumerate(categories) if i not in bad_indices]
 
+def load_train_data():
+    '''
+    Loads the set of train data and results
+    '''
+    abstracts, categories = [], []
+    with instrument.stage('load_train_data') as stage:
+        for _, abstract, category in iter_train_data():
+            abstracts.append(abstract)
+            categories.append(category)
+        stage.add(len(abstracts))
     return abstracts, categories
 
 
@@ -153,22 +498,23 @@ def load_test_data():
     '''
     Loads the set of test data
     '''
-    # Load test data
-    with open('test_input.csv') as fp:
-        reader = csv.reader(fp)
-        train_input = list(reader)[1:]
-
-    abstracts = map(lambda x: x[1], train_input)
-
+    with instrument.stage('load_test_data') as stage:
+        abstracts = [abstract for _, abstract in iter_test_data()]
+        stage.add(len(abstracts))
     return abstracts
 
 
-def write_test_output(output_data):
+def write_test_output(output_data, output_path='test_output.csv'):
     '''
-    Writes a set of predictions to file
+    Writes a set of predictions to file.
+    output_data can be any iterable of categories, or of (id, category)
+    pairs, so predictions can be streamed straight to disk.
     '''
-    with open('test_output.csv', 'wb') as fp:
+    with open(output_path, 'wb') as fp:
         writer = csv.writer(fp, quoting=csv.QUOTE_ALL)
         writer.writerow(['id', 'category'])  # write header
-        for i, category in enumerate(output_data):
-            writer.writerow((str(i), category))
+        for i, row in enumerate(output_data):
+            if isinstance(row, tuple):
+                writer.writerow(row)
+            else:
+                writer.writerow((str(i), row))
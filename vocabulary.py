@@ -0,0 +1,189 @@
+from __future__ import division
+from collections import Counter, defaultdict
+from classifiers import information_gain, weighted_counts
+from corpus import Corpus
+from storage import read_model, write_model
+import numpy as np
+
+
+class Vocabulary(object):
+    '''
+    The words kept for training and testing. fit counts the words in a
+    single pass and keeps those seen at least min_count times; given the
+    categories, it can also keep only the top_k words by IG and/or the
+    words with an IG of at least min_IG (IG as in utils.compute_IG).
+    transform then drops every other word, from the train set and the
+    test set alike.
+    '''
+    def __init__(self, min_count=1, top_k=None, min_IG=None):
+        self.min_count = min_count
+        self.top_k = top_k
+        self.min_IG = min_IG
+
+        self.words = []
+        self.dictionary = {}
+        self.counts = None
+        self.IG = None
+
+    def __len__(self):
+        return len(self.words)
+
+    def __contains__(self, word):
+        return word in self.dictionary
+
+    def fit(self, examples, categories=None):
+        '''
+        examples can be cleaned abstracts, lists of words or a Corpus,
+        and any iterable of the first two (e.g. a generator)
+        '''
+        if isinstance(examples, Corpus):
+            return self.fit_corpus(examples, categories)
+
+        if categories is None:
+            word_count = Counter()
+            for example in examples:
+                word_count.update(example.split() if isinstance(example, str) else example)
+            return self.fit_counts(word_count)
+
+        class_word_count = defaultdict(Counter)
+        class_count = Counter()
+        for example, category in zip(examples, categories):
+            words = example.split() if isinstance(example, str) else example
+            class_word_count[category].update(words)
+            class_count[category] += 1
+        return self.fit_counts(class_word_count, class_count)
+
+    def fit_corpus(self, corpus, categories=None):
+        '''
+        fit for a Corpus, counting straight from the word ids
+        '''
+        if categories is None:
+            start, end = corpus.offsets[0], corpus.offsets[-1]
+            counts = np.bincount(corpus.token_ids[start:end],
+                                 minlength=len(corpus.vocabulary))
+            return self.select(corpus.vocabulary, counts)
+
+        classes = sorted(set(categories))
+        index = dict((c, i) for i, c in enumerate(classes))
+        rows = np.array([index[c] for c in categories], dtype=int)
+        feature_count, class_count = weighted_counts(corpus, rows, len(classes))
+        return self.select(corpus.vocabulary, feature_count.sum(axis=1),
+                           feature_count, class_count)
+
+    def fit_counts(self, word_count, class_count=None):
+        '''
+        fit from counts made elsewhere: either a word -> count mapping,
+        or a category -> word -> count mapping together with the number
+        of examples of each category
+        '''
+        if class_count is None:
+            words = list(word_count)
+            return self.select(words, np.array([word_count[w] for w in words]))
+
+        classes = sorted(class_count)
+        words = list(set(w for c in classes for w in word_count[c]))
+        feature_count = np.array([[word_count[c].get(w, 0) for c in classes]
+                                  for w in words], dtype=float).reshape(len(words), len(classes))
+        class_count = np.array([class_count[c] for c in classes], dtype=float)
+        return self.select(words, feature_count.sum(axis=1), feature_count, class_count)
+
+    def select(self, words, counts, feature_count=None, class_count=None):
+        '''
+        Applies the thresholds. The kept words are stored sorted, so
+        the result does not depend on the order the words were seen in.
+        '''
+        keep = np.asarray(counts) >= self.min_count
+        IG = None
+        assert self.min_IG is None or feature_count is not None, "min_IG needs the categories"
+        if feature_count is not None:
+            IG = information_gain(feature_count, class_count)
+            if self.min_IG is not None:
+                keep &= IG >= self.min_IG
+        if self.top_k is not None and keep.sum() > self.top_k:
+            assert IG is not None, "top_k needs the categories"
+            # ties (up to rounding) go to the first word alphabetically
+            kept = sorted(np.flatnonzero(keep), key=lambda i: (-round(IG[i], 12), words[i]))
+            best = kept[:self.top_k]
+            keep[:] = False
+            keep[best] = True
+
+        order = sorted(np.flatnonzero(keep), key=lambda i: words[i])
+        self.words = [words[i] for i in order]
+        self.dictionary = dict((w, i) for i, w in enumerate(self.words))
+        self.counts = np.asarray(counts)[order]
+        self.IG = IG[order] if IG is not None else None
+        return self
+
+    def mask(self, vocabulary):
+        '''
+        For the words of another vocabulary (e.g. of a Corpus), their id
+        in this one or -1 for words that are not kept
+        '''
+        get = self.dictionary.get
+        return np.array([get(w, -1) for w in vocabulary], dtype=np.intc)
+
+    def transform(self, examples):
+        '''
+        Drops the words that are not kept. Returns a Corpus over this
+        vocabulary for a Corpus, and otherwise cleaned abstracts or
+        lists of words like the input.
+        '''
+        if isinstance(examples, Corpus):
+            return self.transform_corpus(examples)
+
+        dictionary = self.dictionary
+
+        def transform_one(example):
+            if isinstance(example, str):
+                return ' '.join([w for w in example.split(' ') if w in dictionary])
+            return [w for w in example if w in dictionary]
+        return map(transform_one, examples)
+
+    def transform_corpus(self, corpus):
+        start, end = corpus.offsets[0], corpus.offsets[-1]
+        token_ids = self.mask(corpus.vocabulary)[corpus.token_ids[start:end]]
+        kept = token_ids >= 0
+        kept_before = np.zeros(len(token_ids) + 1, dtype=np.int_)
+        np.cumsum(kept, out=kept_before[1:])
+        offsets = kept_before[corpus.offsets - start]
+        return Corpus(token_ids[kept], offsets, self.words, self.dictionary)
+
+    def fit_transform(self, examples, categories=None):
+        return self.fit(examples, categories).transform(examples)
+
+    def to_corpus(self, examples):
+        '''
+        Builds a Corpus over this vocabulary from cleaned abstracts or
+        lists of words, dropping the other words on the way
+        '''
+        if examples and isinstance(examples[0], str):
+            return Corpus.from_abstracts(examples, self.words)
+        return Corpus.from_examples(examples, self.words)
+
+    def save(self, path):
+        '''
+        Writes the vocabulary (words, counts, IG and thresholds) to path,
+        in the same format as the classifiers (see storage.py)
+        '''
+        header = {'type': 'Vocabulary', 'min_count': self.min_count,
+                  'top_k': self.top_k, 'min_IG': self.min_IG}
+        arrays = {'counts': np.asarray(self.counts if self.counts is not None else [])}
+        if self.IG is not None:
+            arrays['IG'] = self.IG
+        write_model(path, header, arrays, self.words)
+
+    @classmethod
+    def load(cls, path, mmap=False):
+        '''
+        Reads a vocabulary written by save. Any model file written by
+        Classifier.save works too: its vocabulary is the words it knows.
+        '''
+        header, arrays, words = read_model(path, mmap)
+        vocabulary = cls(header.get('min_count', 1), header.get('top_k'),
+                         header.get('min_IG'))
+        vocabulary.words = words or []
+        vocabulary.dictionary = dict((w, i) for i, w in enumerate(vocabulary.words))
+        if header['type'] == 'Vocabulary':
+            vocabulary.counts = arrays['counts']
+            vocabulary.IG = arrays.get('IG')
+        return vocabulary